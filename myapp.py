@@ -1,16 +1,17 @@
 ### IMPORT :
 
 # python packages
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import time
+import os
 
 # mypackages
-import myfinutils as fin
 import myblackscholes as bs
 import myautocallable as acl
 import mygreeks as grk
+import mymarketdata as mkt
+import mycalibration as cal
+import mylocalvol as lv
 
 
 ### INPUTS :
@@ -34,48 +35,47 @@ S_p = S_0 * protection # PROTECTION BARRIER
 S_k = S_0 * kickout # KICKOUT BARRIER
 t_steps = range(t_0+1, T+1)
 
-# input from excel file
-xls_data = pd.ExcelFile('res\\Data_Pricing.xlsx') # read pathfile
+# input from excel file (binary snapshot rebuilt only when the file changes)
+market = mkt.loadMarketData(os.path.join('res', 'Data_Pricing.xlsx'))
 maturity_yrs = np.arange(2016, 2025+1, 1)
 
 # strike prices
-Strk = pd.read_excel(xls_data, sheet_name='Strike_Price', header=None, names=maturity_yrs)
+Strk = market['Strk']
 # time to maturities
-TtM = pd.read_excel(xls_data, sheet_name='Maturity', header=None, names=maturity_yrs)
+TtM = market['TtM']
 # call options
-Call = pd.read_excel(xls_data, sheet_name='Call_Price', header=None, names=maturity_yrs)
+Call = market['Call']
 # put options
-Put = pd.read_excel(xls_data, sheet_name='Put_Price', header=None, names=maturity_yrs)
+Put = market['Put']
 # spot prices
-Spot = pd.read_excel(xls_data, sheet_name='Underlying_Price', header=None, names=maturity_yrs)
+Spot = market['Spot']
 # (daily) risk-free rate
-d_RfR = pd.read_excel(xls_data, sheet_name='Risk_Free_Rate_EONIA', header=None, names=maturity_yrs)
+d_RfR = market['d_RfR']
 
 
 ### VARS ESTIMATION :
 
 starting_time = time.time()
 
-# interest rate
-InR = fin.interestRate(Call, Put, Spot, Strk, TtM)
-# implied volatility
-flag = 'C' # call option is used for implied vol
-ImV = fin.impliedVolatilitySurface(Call, flag, Spot, Strk, TtM, InR)
-# risk-free rate -> discount rate
-DsR = d_RfR.iloc[0] * np.sqrt(365)
+# interest rate, implied volatility (call option is used), discount rate and
+# their interpolation at the protection barrier, cached by market data and barrier
+flag = 'C'
+InR, ImV, DsR, k_Drift, k_Vol, k_TtM = cal.calibrate(market, S_p, t_steps, flag, cache_dir=os.path.join('res', '.cache', 'calibration'))
 # debug
 elapsed_time = time.time() - starting_time
 print('Interest rates, implied volatility, discount rates estimated in', elapsed_time, 's\n')
 
-# find key-values to interpolate from dataframes
-S = Strk[t_steps[0]]
-i = 0
-while (S_p > S[i]):  
-    i += 1
-# interpolation: dataframes -> series
-k_Drift = (InR.iloc[i] * (S_p - S[i-1]) + InR.iloc[i-1] * (S[i] - S_p)) / (S[i] - S[i-1])
-k_Vol = (ImV.iloc[i] * (S_p - S[i-1]) + ImV.iloc[i-1] * (S[i] - S_p)) / (S[i] - S[i-1])
-k_TtM = TtM.iloc[0] # constant over strike value
+
+### LOCAL VOLATILITY PRICE :
+
+# dupire grid built once from the whole implied volatility surface (not only k_Vol)
+print('\nSIMULATING LOCAL VOLATILITY PRICE...\n')
+starting_time = time.time()
+lv_grid = lv.localVolGrid(ImV, Strk[t_steps[0]], k_TtM, k_Drift, S_0)
+lv_price, lv_std_err = lv.localVolMonteCarloPrice(t_steps, k_TtM, k_Drift, DsR, S_0, S_k, S_p, N, I, n_simu, lv_grid)
+# debug
+print('Local volatility price =', lv_price, '+/-', lv_std_err)
+print('Elapsed time =', time.time() - starting_time, 's\n')
 
 
 ### PLOT GREEKS BY MONTECARLO SIMULATION :
@@ -140,5 +140,6 @@ print('Elapsed time =', time.time() - starting_time, 's')
 # plot gamma
 fig4, ax41, ax42 = grk.plot(gamma, spot_midmid, priceForDelta, spot, 'GAMMA', 'PRICE', 'SPOT PRICE')
 
-# show plots
+# show plots (matplotlib is only loaded here and by grk.plot)
+import matplotlib.pyplot as plt
 plt.show() 
@@ -1,3 +1,12 @@
+import math
+import functools
+import collections
+import numpy as np
+import myinstrument as ins
+import mypathstore as pst
+import myrandom as rnd
+
+
 def payoff(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, RND):
 
     # INPUT:
@@ -11,36 +20,33 @@ def payoff(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, RND):
     # S_p     : protection barrier
     # N       : nominal value
     # I       : yearly interest over the nominal
-    # RND     : random terms
+    # RND     : random terms by time (series by time or array by position)
+    # (TtM can also be a TermStructure, see termStructure, then Drift, Vol, Disc are not used)
 
     # OUTPUT:
     # out     : autocallable structure simulated discounted payoff
 
-    from numpy import exp, sqrt
-
-    # vars
-    S_prev = S_0
-    TtM[TtM.index[0]-1] = 0 # solve index issue in 'dt'
+    # vars (positional arrays, the inputs are not modified)
+    ts = termStructure(t_steps, TtM, Drift, Vol, Disc)
+    if hasattr(RND, 'loc'):
+        RND = RND.loc[list(t_steps)].to_numpy(dtype=float)
+    S_t = S_0
 
     # simu
-    for t in t_steps:
-        # diff = vol[t] * random() # check it # diffusion term
+    for t in range(len(ts.TtM)):
 
         # underlying dynamics
-        dt = TtM[t] - TtM[t-1]
-        S_t = S_prev * exp((Drift[t] - 0.5 * Vol[t] ** 2) * dt + Vol[t] * RND[t] * sqrt(dt))
-        # update previous value
-        S_prev = S_t
+        S_t = S_t * math.exp(ts.drift_dt[t] + ts.vol_sqrt_dt[t] * RND[t])
 
         # kick out barrier touched at t
         if S_t >= S_k:
-            return (1 + TtM[t] * I) * exp(- Disc[t] * TtM[t])
+            return (1 + ts.TtM[t] * I) * ts.disc[t]
 
     # kick out barrier never touched before the maturity
     if S_t > S_p:
-        return (exp(- Disc[t] * TtM[t]))
+        return ts.disc[-1]
     else:
-        return (S_t / S_0 * exp(- Disc[t] * TtM[t]))
+        return S_t / S_0 * ts.disc[-1]
 
 # modified function for distribuited monte carlo method
 def _payoff(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I):
@@ -60,8 +66,6 @@ def _payoff(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I):
     # OUTPUT:
     # out     : autocallable structure simulated discounted payoff
 
-    from numpy import exp, sqrt, random
-
     # vars
     S_prev = S_0
     TtM_prev = 0
@@ -70,7 +74,7 @@ def _payoff(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I):
     for t in range(len(t_steps)):
 
         # underlying dynamics
-        S_t = S_prev * exp((Drift[t] - 0.5 * Vol[t] ** 2) * (TtM[t] - TtM_prev) + Vol[t] * random.randn() * sqrt(TtM[t] - TtM_prev))
+        S_t = S_prev * np.exp((Drift[t] - 0.5 * Vol[t] ** 2) * (TtM[t] - TtM_prev) + Vol[t] * np.random.randn() * np.sqrt(TtM[t] - TtM_prev))
 
         # update previous values
         TtM_prev = TtM[t]
@@ -78,21 +82,286 @@ def _payoff(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I):
 
         # kick out barrier touched at t
         if S_t >= S_k:
-            return (1 + TtM[t] * I) * exp(- Disc[t] * TtM[t])
+            return (1 + TtM[t] * I) * np.exp(- Disc[t] * TtM[t])
 
     # kick out barrier never touched before the maturity
     if S_t > S_p:
-        return (exp(- Disc[t] * TtM[t]))
+        return (np.exp(- Disc[t] * TtM[t]))
+    else:
+        return (S_t / S_0 * np.exp(- Disc[t] * TtM[t]))
+
+# vectorized function over the whole path matrix
+def vectorizedPayoff(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, RND, monitoring='discrete', U=None):
+
+    # INPUT:
+    # t_steps : time steps
+    # TtM     : time to maturity
+    # Drift   : drift list by time
+    # Vol     : volatility list by time
+    # Disc    : discount rate
+    # S_0     : underlying initial value
+    # S_k     : kickout barrier
+    # S_p     : protection barrier
+    # N       : nominal value
+    # I       : yearly interest over the nominal
+    # RND     : random terms, matrix of shape (n_simu, len(t_steps))
+    # (Drift, Vol can also be arrays of shape (n_scenarios, 1, len(t_steps)) and S_0 of
+    #  shape (n_scenarios, 1) to reprice several scenarios on the same random terms,
+    #  likewise S_p, I of shape (n_scenarios, 1) and S_k of shape (n_scenarios, 1, 1)
+    #  to price several contracts)
+
+    # (TtM can also be a TermStructure, see termStructure, then Drift, Vol, Disc are not
+    #  used and the paths are simulated in its precision)
+    # monitoring : 'discrete' = kick out tested at the time steps only,
+    #              'continuous' = kick out tested at any time by brownian bridge, a crossing
+    #              between two time steps is redeemed at the second one
+    # U       : uniform terms of the same shape as RND to sample the crossings,
+    #           None = the payoff is weighted by the crossing probabilities (continuous only)
+
+    # OUTPUT:
+    # out     : array of autocallable structure simulated discounted payoffs
+
+    # term structure on the simulation grid
+    ts = termStructure(t_steps, TtM, Drift, Vol, Disc)
+    TtM, disc = ts.TtM, ts.disc
+    RND = np.asarray(RND, dtype=TtM.dtype)
+    S_0 = np.asarray(S_0, dtype=TtM.dtype)
+
+    # underlying dynamics (all paths and time steps at once)
+    S = S_0[..., None] * np.exp(np.cumsum(ts.drift_dt + ts.vol_sqrt_dt * RND, axis=-1))
+
+    if monitoring == 'continuous':
+        return _bridgePayoff(t_steps, ts, S, S_0, S_k, S_p, I, U)
+    elif monitoring != 'discrete':
+        raise ValueError("monitoring must be 'discrete' or 'continuous'")
+
+    # first kick out date by path
+    kicked = S >= S_k
+    touched = kicked.any(axis=-1)
+    t_ko = kicked.argmax(axis=-1)
+
+    # discounted payoffs
+    out = np.where(S[..., -1] > S_p, 1.0, S[..., -1] / S_0) * disc[-1]
+    out[touched] = (1 + TtM[t_ko[touched]] * np.broadcast_to(I, out.shape)[touched]) * disc[t_ko[touched]]
+
+    if ins.enabled():
+        countPaths(t_steps, touched, t_ko)
+
+    return out
+
+
+def _bridgePayoff(t_steps, ts, S, S_0, S_k, S_p, I, U=None):
+
+    # INPUT:
+    # ts      : TermStructure of the simulation grid
+    # S       : simulated underlying at the time steps (see vectorizedPayoff)
+    # U       : uniform terms to sample the crossings, None = weighted by their probabilities
+    # (other inputs as vectorizedPayoff)
+
+    # OUTPUT:
+    # out     : discounted payoffs with the kick out barrier monitored continuously
+
+    # Given the log spot x, y at both ends of a time step, both below the log barrier b, the
+    # brownian bridge in between crosses b with probability exp(- 2 (b - x) (b - y) / (vol^2 dt)),
+    # so the crossings between the time steps cost no simulated date.
+
+    b = np.log(np.asarray(S_k, dtype=S.dtype))
+    x = np.log(S)
+    x_prev = np.concatenate([np.broadcast_to(np.log(S_0)[..., None], x[..., :1].shape), x[..., :-1]], axis=-1)
+    with np.errstate(over='ignore'):
+        p = np.exp(- 2 * np.maximum(b - x_prev, 0) * np.maximum(b - x, 0) / ts.vol_sqrt_dt ** 2)
+    p = np.where(x >= b, 1.0, p)
+
+    # redemption if the barrier is crossed at a time step, and if it is never crossed
+    pay = (1 + ts.TtM * np.asarray(I)[..., None]) * ts.disc
+    terminal = np.where(S[..., -1] > S_p, 1.0, S[..., -1] / S_0) * ts.disc[-1]
+
+    if U is not None:
+        # sampled crossings, first one by path
+        kicked = np.asarray(U) < p
+        touched = kicked.any(axis=-1)
+        t_ko = kicked.argmax(axis=-1)
+        out = np.where(touched, np.take_along_axis(np.broadcast_to(pay, p.shape), t_ko[..., None], axis=-1)[..., 0], terminal)
+        if ins.enabled():
+            countPaths(t_steps, touched, t_ko)
+        return out
+
+    # expectation over the crossings given the path at the time steps
+    alive = np.cumprod(1 - p, axis=-1)
+    alive_before = np.concatenate([np.ones_like(alive[..., :1]), alive[..., :-1]], axis=-1)
+    if ins.enabled():
+        ins.count('paths', p[..., 0].size)
+    return (alive_before * p * pay).sum(axis=-1) + alive[..., -1] * terminal
+
+
+def countPaths(t_steps, touched, t_ko):
+
+    # counters of simulated paths and of kick outs by date
+
+    ins.count('paths', touched.size)
+    for t, n in zip(t_steps, np.bincount(t_ko[touched].ravel(), minlength=len(t_steps))):
+        ins.count('kickouts.' + str(t), int(n))
+
+
+def _payoffFunction(backend, monitoring='discrete'):
+
+    # INPUT:
+    # backend    : 'numpy' path matrix or 'numba' compiled per-path loops
+    # monitoring : 'discrete' or 'continuous' (see vectorizedPayoff, numpy backend only)
+
+    # OUTPUT:
+    # out        : payoff function with the same signature as vectorizedPayoff
+
+    if monitoring != 'discrete':
+        if backend != 'numpy':
+            raise ValueError("monitoring='" + str(monitoring) + "' needs the 'numpy' backend")
+        return functools.partial(vectorizedPayoff, monitoring=monitoring)
+    if backend == 'numpy':
+        return vectorizedPayoff
+    elif backend == 'numba':
+        import myjit
+        return myjit.jitPayoff
     else:
-        return (S_t / S_0 * exp(- Disc[t] * TtM[t]))
+        raise ValueError("backend must be 'numpy' or 'numba'")
+
+
+def termArrays(t_steps, TtM, Drift, Vol, Disc):
+
+    # INPUT:
+    # t_steps : time steps
+    # TtM     : time to maturity (pandas series by time or array by position)
+    # Drift   : drift list by time
+    # Vol     : volatility list by time
+    # Disc    : discount rate
+
+    # OUTPUT:
+    # out     : TtM, Drift, Vol, Disc as numpy arrays over t_steps
+
+    if isinstance(TtM, TermStructure):
+        return TtM.TtM, TtM.Drift, TtM.Vol, TtM.Disc
+
+    def onGrid(X):
+        if hasattr(X, 'loc'): # pandas series indexed by time
+            return X.loc[list(t_steps)].to_numpy(dtype=float)
+        return np.asarray(X, dtype=float)[..., :len(t_steps)]
+
+    return onGrid(TtM), onGrid(Drift), onGrid(Vol), onGrid(Disc)
+
+
+def timeGrid(t_steps, TtM):
+
+    # INPUT:
+    # t_steps : time steps
+    # TtM     : time to maturity (pandas series by time, array by position or TermStructure)
+
+    # OUTPUT:
+    # out     : TtM as a numpy array over t_steps
+
+    return termArrays(t_steps, TtM, TtM, TtM, TtM)[0]
+
+
+# term structure on the simulation grid with the per-step quantities of the dynamics
+TermStructure = collections.namedtuple('TermStructure', ['TtM', 'Drift', 'Vol', 'Disc', 'dt', 'sqrt_dt', 'drift_dt', 'vol_sqrt_dt', 'disc'])
+
+
+def termStructure(t_steps, TtM, Drift, Vol, Disc, dtype=None):
+
+    # INPUT:
+    # t_steps : time steps
+    # TtM     : time to maturity (pandas series by time, array by position or TermStructure)
+    # Drift   : drift list by time
+    # Vol     : volatility list by time
+    # Disc    : discount rate
+    # dtype   : np.float64 or np.float32 (halves the memory of the path matrices),
+    #           None = float64 or the precision of a given TermStructure
+
+    # OUTPUT:
+    # out     : TermStructure of read-only contiguous arrays, computed once and reusable
+    #           (small and picklable, so it can be shipped to process or spark workers)
+    #           TtM, Drift, Vol, Disc : inputs over t_steps
+    #           dt, sqrt_dt           : time step and its square root
+    #           drift_dt              : (Drift - 0.5 * Vol ** 2) * dt, drift of the log increments
+    #           vol_sqrt_dt           : Vol * sqrt_dt, std dev of the log increments
+    #           disc                  : discount factors exp(- Disc * TtM)
+    # (Drift, Vol can have a leading scenario axis, see vectorizedPayoff)
+
+    if isinstance(TtM, TermStructure) and (dtype is None or TtM.TtM.dtype == dtype):
+        return TtM
+
+    TtM, Drift, Vol, Disc = termArrays(t_steps, TtM, Drift, Vol, Disc)
+    dt = np.diff(TtM, prepend=0)
+    sqrt_dt = np.sqrt(dt)
+    fields = [TtM, Drift, Vol, Disc, dt, sqrt_dt, (Drift - 0.5 * Vol ** 2) * dt, Vol * sqrt_dt, np.exp(- Disc * TtM)]
+
+    return TermStructure(*frozen(fields, dtype))
+
+
+def frozen(fields, dtype=None):
+
+    # INPUT:
+    # fields : list of arrays
+    # dtype  : np.float64 or np.float32, None = float64
+
+    # OUTPUT:
+    # out    : list of read-only contiguous copies, safe to share between pricings and threads
+
+    out = []
+    for X in fields:
+        X = np.array(X, dtype=np.float64 if dtype is None else dtype, order='C') # own copy
+        X.flags.writeable = False
+        out.append(X)
+
+    return out
+
+
+def readPaths(source, start, stop, n_steps):
+
+    # INPUT:
+    # source  : PathStore (see mypathstore) or CounterRNG (see myrandom)
+    # start   : first path
+    # stop    : last path (excluded)
+    # n_steps : number of time steps
+
+    # OUTPUT:
+    # out     : random terms of the paths start to stop
+
+    if isinstance(source, pst.PathStore):
+        return pst.readPaths(source, start, stop)
+    return rnd.readNormals(source, start, stop, n_steps)
+
+
+def isSource(RND):
+    return isinstance(RND, (pst.PathStore, rnd.CounterRNG))
+
+
+def _sourceBlocks(source, n_simu, block_size):
+
+    # INPUT:
+    # source     : PathStore or CounterRNG
+    # n_simu     : number of paths
+    # block_size : number of paths by block (replaced by the canonical one of a CounterRNG)
+
+    # OUTPUT:
+    # out        : list of (source, start, stop) path ranges
+
+    # With a CounterRNG the blocks, hence the statistics merged block by block, depend neither
+    # on the backend nor on the number of workers: the prices are bit-identical.
+
+    if isinstance(source, pst.PathStore):
+        n_simu = min(int(n_simu), source.n_simu)
+    else:
+        block_size = source.block_size
+    return [(source, start, min(start + int(block_size), int(n_simu))) for start in range(0, int(n_simu), int(block_size))]
 
 
 # PRICING TOOLS :
 # * classic monte carlo method
+# * vectorized monte carlo method
+# * streaming monte carlo method
 # * parallel monte carlo method
 # * distribuited monte carlo method with pyspark
 
-def monteCarloPrice(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, n_simu, RND):
+def monteCarloPrice(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, n_simu, RND, method=None):
 
     # INPUT:
     # t_steps : time steps
@@ -106,33 +375,68 @@ def monteCarloPrice(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, n_simu,
     # N       : nominal value
     # I       : yearly interest over the nominal
     # n_simu  : number of simulations
-    # RND     : random terms
+    # RND     : random terms (or PathStore, see mypathstore, or CounterRNG, see myrandom),
+    #           a PathStore caps n_simu at its number of paths
+    # method  : None or variance reduction method (see myvariance.reducedMonteCarloPrice)
 
     # OUTPUT:
     # out     : autocallable structure price
 
-    import numpy as np 
-    import pandas as pd 
-    import time
+    return monteCarloStats(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, n_simu, RND, method)[0]
 
-    if RND == None:
+
+@ins.instrumented('acl.monteCarloStats')
+def monteCarloStats(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, n_simu, RND, method=None):
+
+    # INPUT:
+    # (same as monteCarloPrice)
+
+    # OUTPUT:
+    # price   : autocallable structure price
+    # std_err : standard error of the price
+    # n_done  : number of simulations performed
+    # vrf     : variance reduction factor over plain monte carlo (1 without method)
+
+    if isinstance(RND, pst.PathStore):
+        # no more paths than the store holds (as the other backends)
+        n_simu = min(int(n_simu), RND.n_simu)
+    if isSource(RND):
+        RND = readPaths(RND, 0, n_simu, len(t_steps))
+
+    if method is not None:
+        # variance reduction, on the vectorized engine
+        import myvariance as vr
+        setup = vr.varianceSetup(method, t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I)
+        if RND is None:
+            RND = np.random.randn(vr.sampleCount(setup, n_simu), len(t_steps))
+        moments = vr.blockMoments(setup, np.asarray(RND, dtype=float))
+        price, std_err, vrf = vr.finalizeMoments(setup, moments)
+        return price, std_err, int(moments[0]) * vr.pathsBySample(setup), vrf
+
+    if RND is None:
         # generate pseudo-random sequence
-        RND = pd.DataFrame(np.random.randn(int(n_simu), len(t_steps)), columns=t_steps)
+        RND = np.random.randn(int(n_simu), len(t_steps))
+    elif hasattr(RND, 'loc'): # dataframe with the time steps as columns
+        RND = RND[list(t_steps)].to_numpy(dtype=float)
+
+    # term structure prepared once for all the paths
+    ts = termStructure(t_steps, TtM, Drift, Vol, Disc)
 
     # starting_t = time.time()
 
     payoffs = [0] * int(n_simu) # initializes list
     for i in range(int(n_simu)):
-        payoffs[i] = payoff(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, RND.iloc[i])
+        payoffs[i] = payoff(t_steps, ts, None, None, None, S_0, S_k, S_p, N, I, RND[i])
     
     # elapsed_t = time.time() - starting_t 
     # print('\nMonte Carlo simulation completed in', elapsed_t, 's')
 
-    return sum(payoffs) / n_simu
+    return sum(payoffs) / n_simu, stdErr(chunkStats(payoffs)), int(n_simu), 1.0
 
 
-# using Parallel from joblib package
-def parallelMonteCarloPrice(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, n_simu, RND):
+# using numpy arrays over the whole path matrix
+@ins.instrumented('acl.vectorizedMonteCarloPrice')
+def vectorizedMonteCarloPrice(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, n_simu, RND, backend='numpy', monitoring='discrete'):
 
     # INPUT:
     # t_steps : time steps
@@ -146,101 +450,415 @@ def parallelMonteCarloPrice(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I,
     # N       : nominal value
     # I       : yearly interest over the nominal
     # n_simu  : number of simulations
-    # RND     : random terms
+    # RND     : random terms (or PathStore, see mypathstore, or CounterRNG, see myrandom),
+    #           a PathStore caps n_simu at its number of paths
+    # backend : 'numpy' path matrix or 'numba' compiled per-path loops
+    # monitoring : 'discrete' or 'continuous' kick out barrier (see vectorizedPayoff)
 
     # OUTPUT:
     # out     : autocallable structure price
 
-    from joblib import Parallel, delayed
-    import numpy as np 
-    import pandas as pd 
-    import time
-
-    if RND == None:
+    if isinstance(RND, rnd.CounterRNG):
+        # canonical blocks, merged in order (same price as the other backends)
+        stats = (0, 0.0, 0.0)
+        for source, start, stop in _sourceBlocks(RND, n_simu, None):
+            payoffs = _payoffFunction(backend, monitoring)(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, readPaths(source, start, stop, len(t_steps)))
+            stats = mergeStats(stats, chunkStats(payoffs))
+        return float(stats[1])
+    elif isinstance(RND, pst.PathStore):
+        n_simu = min(int(n_simu), RND.n_simu)
+        RND = pst.readPaths(RND, 0, n_simu)
+    elif RND is None:
+        if backend == 'numba' and monitoring == 'discrete':
+            # random terms drawn inside the compiled kernel
+            import myjit
+            return myjit.jitMonteCarloPrice(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, n_simu)[0]
         # generate pseudo-random sequence
-        RND = pd.DataFrame(np.random.randn(int(n_simu), len(t_steps)), columns=t_steps)
+        RND = np.random.randn(int(n_simu), len(t_steps))
 
-    # starting_t = time.time()
-    
-    payoffs = [0] * int(n_simu) # initializes list
+    # (as monteCarloPrice, only the first n_simu paths of a given matrix are priced)
+    payoffs = _payoffFunction(backend, monitoring)(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, RND[:int(n_simu)])
 
-    # 'n_jobs=-1' uses all the PCU cores
-    payoffs = Parallel(n_jobs=-1)(delayed(payoff)(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, RND.iloc[i]) for i in range(int(n_simu)))
+    return payoffs.sum() / len(payoffs)
 
-    # elapsed_t = time.time() - starting_t
-    # print('\nMonte Carlo simulation completed in', elapsed_t, 's')
 
-    return sum(payoffs) / n_simu
+# using fixed-size chunks of paths and running statistics (bounded memory)
+@ins.instrumented('acl.streamingMonteCarloPrice')
+def streamingMonteCarloPrice(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, n_simu, chunk_size=int(1e5), target_se=None, seed=None, backend='numpy', monitoring='discrete', store=None):
+
+    # INPUT:
+    # t_steps    : time steps
+    # TtM        : time to maturity
+    # Drift      : drift list by time
+    # Vol        : volatility list by time
+    # Disc       : discount rate
+    # S_0        : underlying initial value
+    # S_k        : kickout barrier
+    # S_p        : protection barrier
+    # N          : nominal value
+    # I          : yearly interest over the nominal
+    # n_simu     : (maximum) number of simulations
+    # chunk_size : number of paths generated and priced at once
+    # target_se  : stops as soon as the standard error is below it (None = run all n_simu)
+    # seed       : seed of the pseudo-random generator
+    # backend    : 'numpy' path matrix or 'numba' compiled per-path loops
+    # monitoring : 'discrete' or 'continuous' kick out barrier (see vectorizedPayoff)
+    # store      : PathStore (see mypathstore) or CounterRNG (see myrandom) the random terms
+    #              are read from, replaces seed (and chunk_size by its block size for a CounterRNG)
+
+    # OUTPUT:
+    # price      : autocallable structure price
+    # std_err    : standard error of the price
+    # n_done     : number of simulations actually performed
+
+    rng = np.random.default_rng(seed)
+    payoffFunction = _payoffFunction(backend, monitoring)
+    stats = (0, 0.0, 0.0)
+
+    # term structure prepared once for all the chunks, random terms drawn in its precision
+    ts = termStructure(t_steps, TtM, Drift, Vol, Disc)
+
+    n_simu = int(n_simu)
+    if isinstance(store, pst.PathStore):
+        n_simu = min(n_simu, store.n_simu)
+    elif isinstance(store, rnd.CounterRNG):
+        chunk_size = store.block_size
+    while stats[0] < n_simu:
+        n_chunk = min(int(chunk_size), n_simu - stats[0])
+        with ins.timer('acl.rng'):
+            if store is None:
+                RND = rng.standard_normal((n_chunk, len(t_steps)), dtype=ts.TtM.dtype)
+            else:
+                RND = readPaths(store, stats[0], stats[0] + n_chunk, len(t_steps))
+        with ins.timer('acl.paths'):
+            payoffs = payoffFunction(t_steps, ts, None, None, None, S_0, S_k, S_p, N, I, RND)
+        stats = mergeStats(stats, chunkStats(payoffs))
+
+        # early stop on the requested accuracy
+        if target_se is not None and stats[0] > 1 and stdErr(stats) < target_se:
+            break
+
+    return float(stats[1]), stdErr(stats), stats[0]
+
+
+# running statistics as (count, mean, sum of squared deviations)
+
+def chunkStats(payoffs):
+    payoffs = np.asarray(payoffs, dtype=float) # statistics in double precision
+    count = len(payoffs)
+    mean = payoffs.mean() if count > 0 else 0.0
+    return count, mean, ((payoffs - mean) ** 2).sum()
+
+
+def mergeStats(a, b):
+    # pairwise update of Welford / Chan et al.
+    count = a[0] + b[0]
+    if count == 0:
+        return 0, 0.0, 0.0
+    delta = b[1] - a[1]
+    mean = a[1] + delta * b[0] / count
+    m2 = a[2] + b[2] + delta ** 2 * a[0] * b[0] / count
+    return count, mean, m2
+
+
+def stdErr(stats):
+    if stats[0] < 2:
+        return float('nan')
+    return float((stats[2] / (stats[0] - 1) / stats[0]) ** 0.5)
+
+
+# using Parallel from joblib package (one large shard of paths per core)
+def parallelMonteCarloPrice(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, n_simu, RND, n_jobs=-1, seed=None, block_size=int(1e5), method=None):
+
+    # INPUT:
+    # t_steps    : time steps
+    # TtM        : time to maturity
+    # Drift      : drift list by time
+    # Vol        : volatility list by time
+    # Disc       : discount rate
+    # S_0        : underlying initial value
+    # S_k        : kickout barrier
+    # S_p        : protection barrier
+    # N          : nominal value
+    # I          : yearly interest over the nominal
+    # n_simu     : number of simulations
+    # RND        : random terms (None = generated by the workers, PathStore = read by the
+    #              workers from the memory maps, see mypathstore, CounterRNG = generated by the
+    #              workers in its canonical blocks, see myrandom)
+    # n_jobs     : number of worker processes ('-1' uses all the CPU cores, '-2' all but one)
+    # seed       : seed of the pseudo-random generator
+    # block_size : number of paths drawn from the same random stream
+    # method     : None or variance reduction method (see myvariance.reducedMonteCarloPrice)
+
+    # OUTPUT:
+    # out        : autocallable structure price
+
+    return parallelMonteCarloStats(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, n_simu, RND, n_jobs, seed, block_size, method)[0]
+
+
+@ins.instrumented('acl.parallelMonteCarloStats')
+def parallelMonteCarloStats(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, n_simu, RND, n_jobs=-1, seed=None, block_size=int(1e5), method=None):
+
+    # INPUT:
+    # (same as parallelMonteCarloPrice)
+
+    # OUTPUT:
+    # price      : autocallable structure price
+    # std_err    : standard error of the price
+    # n_done     : number of simulations performed
+    # vrf        : variance reduction factor over plain monte carlo (1 without method)
+
+    from joblib import Parallel, delayed, effective_n_jobs
+
+    n_simu = int(n_simu)
+    n_jobs = effective_n_jobs(n_jobs)
+
+    # term structure prepared once and shipped to the workers
+    TtM = termStructure(t_steps, TtM, Drift, Vol, Disc)
+    Drift = Vol = Disc = None
+
+    setup = None
+    if method is not None:
+        import myvariance as vr
+        setup = vr.varianceSetup(method, t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, seed)
+        if RND is None or isSource(RND):
+            n_simu = vr.sampleCount(setup, n_simu)
+
+    if isSource(RND):
+        # path ranges, each worker maps or generates its own paths (nothing is copied here)
+        blocks = _sourceBlocks(RND, n_simu, block_size)
+    elif RND is None:
+        # split paths in fixed blocks, each one with an independent random stream:
+        # the blocks do not depend on the number of workers, so neither does the price
+        n_blocks = -(-n_simu // int(block_size))
+        sizes = [int(block_size)] * (n_blocks - 1) + [n_simu - int(block_size) * (n_blocks - 1)]
+        blocks = list(zip(sizes, np.random.SeedSequence(seed).spawn(n_blocks)))
+    else:
+        blocks = np.array_split(np.asarray(RND, dtype=float), min(n_jobs, n_simu))
+
+    # one task by worker, each one returning only partial statistics by block
+    shards = [blocks[i::n_jobs] for i in range(min(n_jobs, len(blocks)))]
+    # (paths and kick outs are counted in the worker processes, not here)
+    ins.count('parallel.blocks', len(blocks))
+    with ins.timer('acl.parallel.workers'):
+        results = Parallel(n_jobs=n_jobs)(delayed(_shardStats)(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, shard, setup) for shard in shards)
+
+    if setup is not None:
+        # moments are merged by adding them
+        moments = sum(results[b % len(shards)][b // len(shards)] for b in range(len(blocks)))
+        price, std_err, vrf = vr.finalizeMoments(setup, moments)
+        return price, std_err, int(moments[0]) * vr.pathsBySample(setup), vrf
+
+    # merge partial statistics in block order
+    stats = (0, 0.0, 0.0)
+    for b in range(len(blocks)):
+        stats = mergeStats(stats, results[b % len(shards)][b // len(shards)])
+
+    return float(stats[1]), stdErr(stats), stats[0], 1.0
+
+
+def _shardStats(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, blocks, setup=None):
+
+    # INPUT:
+    # blocks  : list of random matrices, of (n_paths, seed sequence) couples or of
+    #           (PathStore or CounterRNG, start, stop) path ranges
+    # setup   : None or variance reduction estimator (see myvariance.varianceSetup)
+    # (other inputs as vectorizedPayoff)
+
+    # OUTPUT:
+    # out     : list of (count, mean, sum of squared deviations) by block
+    #           (of moment sums, see myvariance.blockMoments, with a setup)
+
+    out = []
+    for block in blocks:
+        if isinstance(block, tuple) and isSource(block[0]):
+            RND = readPaths(*block, len(t_steps))
+        elif isinstance(block, tuple):
+            RND = np.random.default_rng(block[1]).standard_normal((block[0], len(t_steps)))
+        else:
+            RND = block
+        if setup is not None:
+            import myvariance as vr
+            out.append(vr.blockMoments(setup, RND))
+        else:
+            out.append(chunkStats(vectorizedPayoff(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, RND)))
+
+    return out
 
 
 # using PySpark
-def distribuitedMonteCarloPrice(inputParameter, flagParameter, t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, sc, n_simu):
+def distribuitedMonteCarloPrice(inputParameter, flagParameter, t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, sc, n_simu, seed=None, n_partitions=None, block_size=int(1e5), method=None, store=None):
 
     # INPUT:
-    # t_steps : time steps
-    # TtM     : time to maturity
-    # Drift   : drift list by time
-    # Vol     : volatility list by time
-    # Disc    : discount rate
-    # S_0     : underlying initial value
-    # S_k     : kickout barrier
-    # S_p     : protection barrier
-    # N       : nominal value
-    # I       : yearly interest over the nominal
-    # sc      : spark context
-    # n_simu  : number of simulations
+    # inputParameter : multiplicative bump of the parameter selected by flagParameter
+    # flagParameter  : [] = no bump, 'V' = volatility, 'D' = spot, 'R' = drift
+    # t_steps        : time steps
+    # TtM            : time to maturity
+    # Drift          : drift list by time
+    # Vol            : volatility list by time
+    # Disc           : discount rate
+    # S_0            : underlying initial value
+    # S_k            : kickout barrier
+    # S_p            : protection barrier
+    # N              : nominal value
+    # I              : yearly interest over the nominal
+    # sc             : spark context
+    # n_simu         : number of simulations
+    # seed           : seed of the pseudo-random generator
+    # n_partitions   : number of spark partitions (None = sc.defaultParallelism)
+    # block_size     : number of paths priced at once inside a partition
+    # method         : None or variance reduction method (see myvariance.reducedMonteCarloPrice)
+    # store          : PathStore the random terms are read from, replaces seed (see mypathstore,
+    #                  its folder must be reachable by the executors, e.g. on a shared file system),
+    #                  or CounterRNG generating them on the executors in its canonical blocks
+    #                  (see myrandom), which replaces seed, n_partitions and block_size
 
     # OUTPUT:
-    # out     : autocallable structure price
+    # out            : autocallable structure price
 
-    import numpy as np 
-    import pandas as pd 
-    import time
-    import pyspark
-    from pyspark import SparkConf, SparkContext
-    from pyspark.sql import Row
-
-    # convert pandas series to numpy array
-    TtM = TtM.to_numpy()
-    Drift = Drift.to_numpy()
-    Vol = Vol.to_numpy()
-    Disc = Disc.to_numpy()
-    # initialize accumulator
-    outputSum = sc.accumulator(0)
-    
+    stats = distribuitedMonteCarloStats(inputParameter, flagParameter, t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, sc, n_simu, seed, n_partitions, block_size, method, store)
+    if stats is None:
+        return 0
+
+    return stats[0]
+
+
+@ins.instrumented('acl.distribuitedMonteCarloStats')
+def distribuitedMonteCarloStats(inputParameter, flagParameter, t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, sc, n_simu, seed=None, n_partitions=None, block_size=int(1e5), method=None, store=None):
+
+    # INPUT:
+    # (same as distribuitedMonteCarloPrice)
+
+    # OUTPUT:
+    # price          : autocallable structure price
+    # std_err        : standard error of the price
+    # n_done         : number of simulations performed
+    # vrf            : variance reduction factor over plain monte carlo (1 without method)
+
+    # apply the bump on the driver
     if flagParameter == []:
-        def sparkCustomizedPayoff(_input):
-            outputSum.add(_payoff(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I))
+        pass
     elif flagParameter == 'V':
-        def sparkCustomizedPayoff(_input):
-            _volatility = Vol * _input
-            outputSum.add(_payoff(t_steps, TtM, Drift, _volatility, Disc, S_0, S_k, S_p, N, I))
+        Vol = Vol * inputParameter
     elif flagParameter == 'D':
-        def sparkCustomizedPayoff(_input):
-            _spot = S_0 * _input
-            outputSum.add(_payoff(t_steps, TtM, Drift, Vol, Disc, _spot, S_k, S_p, N, I))
+        S_0 = S_0 * inputParameter
     elif flagParameter == 'R':
-        def sparkCustomizedPayoff(_input):
-            _drift = Drift * _input
-            outputSum.add(_payoff(t_steps, TtM, _drift, Vol, Disc, S_0, S_k, S_p, N, I))
+        Drift = Drift * inputParameter
     else:
-        return 0
+        return None
+
+    # term structure prepared once on the driver (small, shipped in the closure)
+    TtM = termStructure(t_steps, TtM, Drift, Vol, Disc)
+    Drift = Vol = Disc = None
+    n_steps = len(t_steps)
+
+    setup = None
+    if method is not None:
+        import myvariance as vr
+        setup = vr.varianceSetup(method, t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, seed)
+        n_simu = vr.sampleCount(setup, n_simu)
+
+    if isinstance(store, rnd.CounterRNG) and setup is None:
+        return _distribuitedCounterStats(t_steps, TtM, S_0, S_k, S_p, N, I, sc, n_simu, n_partitions, store)
+
+    # fix the entropy on the driver so that retried tasks redraw the same paths
+    entropy = np.random.SeedSequence(seed).entropy
+
+    # only (partition_id, seed, n_paths) tuples are shipped to the cluster
+    # (with a store, the seed is replaced by the first path of the partition in the store)
+    n_simu = int(n_simu) if not isinstance(store, pst.PathStore) else min(int(n_simu), store.n_simu)
+    if n_partitions is None:
+        n_partitions = sc.defaultParallelism
+    n_partitions = max(1, min(int(n_partitions), n_simu))
+    sizes = [n_simu // n_partitions + (1 if p < n_simu % n_partitions else 0) for p in range(n_partitions)]
+    if store is None:
+        tasks = [(p, entropy, sizes[p]) for p in range(n_partitions)]
+    else:
+        tasks = [(p, sum(sizes[:p]), sizes[p]) for p in range(n_partitions)]
+
+    def sparkPartitionSums(iterator):
+        import numpy as np
+        out = [0.0, 0.0, 0] if setup is None else 0
+        for p, source, n_paths in iterator:
+            if store is None:
+                rng = np.random.default_rng(np.random.SeedSequence(source, spawn_key=(p,)))
+            done = 0
+            while done < n_paths:
+                n_block = min(block_size, n_paths - done)
+                if store is None:
+                    RND = rng.standard_normal((n_block, n_steps))
+                else:
+                    RND = readPaths(store, source + done, source + done + n_block, n_steps)
+                if setup is not None:
+                    import myvariance as vr
+                    out = out + vr.blockMoments(setup, RND)
+                else:
+                    payoffs = vectorizedPayoff(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, RND)
+                    out[0] += float(payoffs.sum())
+                    out[1] += float((payoffs ** 2).sum())
+                    out[2] += n_block
+                done += n_block
+        yield tuple(out) if setup is None else out
+
+    # create RDD, price a whole batch by partition, reduce the partial sums
+    # (the job time covers scheduling, executor work and the reduction)
+    simuRDD = sc.parallelize(tasks, n_partitions)
+    ins.count('spark.partitions', n_partitions)
+    if setup is not None:
+        with ins.timer('acl.spark.job'):
+            moments = simuRDD.mapPartitions(sparkPartitionSums).treeReduce(lambda a, b: a + b)
+        price, std_err, vrf = vr.finalizeMoments(setup, moments)
+        return price, std_err, n_simu * vr.pathsBySample(setup), vrf
+
+    with ins.timer('acl.spark.job'):
+        total, total_sq, count = simuRDD.mapPartitions(sparkPartitionSums).treeReduce(lambda a, b: (a[0] + b[0], a[1] + b[1], a[2] + b[2]))
+    ins.count('spark.paths', count)
+
+    price = total / count
+    std_err = float(np.sqrt(max(total_sq / count - price ** 2, 0.0) / max(count - 1, 1)))
+    return price, std_err, count, 1.0
+
+
+def _distribuitedCounterStats(t_steps, ts, S_0, S_k, S_p, N, I, sc, n_simu, n_partitions, rng):
 
+    # INPUT:
+    # ts      : TermStructure of the (bumped) inputs
+    # rng     : CounterRNG
+    # (other inputs as distribuitedMonteCarloStats)
 
-    # generate python collection of initial variables
-    inputData = [inputParameter] * n_simu
+    # OUTPUT:
+    # (same as distribuitedMonteCarloStats)
 
-    # create RDD
-    simuRDD = sc.parallelize(inputData)
-    # print('RDD size :', simuRDD.count()) # debug
+    # the canonical blocks are spread over the partitions and their statistics merged in block
+    # order on the driver, so the price does not depend on the partitioning
+    blocks = _sourceBlocks(rng, n_simu, None)
+    if n_partitions is None:
+        n_partitions = sc.defaultParallelism
+    n_partitions = max(1, min(int(n_partitions), len(blocks)))
+    n_steps = len(t_steps)
 
-    # distribuited computation
-    simuRDD.foreach(sparkCustomizedPayoff)
-    return outputSum.value / n_simu
+    def sparkBlockStats(iterator):
+        for source, start, stop in iterator:
+            payoffs = vectorizedPayoff(t_steps, ts, None, None, None, S_0, S_k, S_p, N, I, readPaths(source, start, stop, n_steps))
+            yield start, chunkStats(payoffs)
 
+    ins.count('spark.partitions', n_partitions)
+    with ins.timer('acl.spark.job'):
+        results = sc.parallelize(blocks, n_partitions).mapPartitions(sparkBlockStats).collect()
+
+    stats = (0, 0.0, 0.0)
+    for start, block_stats in sorted(results, key=lambda r: r[0]):
+        stats = mergeStats(stats, block_stats)
+    ins.count('spark.paths', stats[0])
+
+    return float(stats[1]), stdErr(stats), stats[0], 1.0
+
+
+def startDistribuitedEnvironment(master=None):
+
+    # INPUT:
+    # master : spark master url, e.g. 'local[*]' (None = taken from the environment)
 
-def startDistribuitedEnvironment():
-    
     # import and initialize spark
     import findspark
     findspark.init()
@@ -248,6 +866,8 @@ def startDistribuitedEnvironment():
     from pyspark import SparkConf, SparkContext
 
     conf = SparkConf().setAppName('mySparkApp')
+    if master is not None:
+        conf = conf.setMaster(master)
     sc = SparkContext(conf=conf)
     # spark_context.setLogLevel('WARN')
     
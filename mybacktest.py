@@ -0,0 +1,167 @@
+import myinstrument as ins
+
+
+@ins.instrumented('bt.backtest')
+def backtest(snapshots, out_path, kickout=1.10, protection=0.95, I=0.04, n_years=5, N=1, n_simu=int(1e5), seed=0, n_jobs=-1, dates_by_task=None, cache_dir=None):
+
+    # INPUT:
+    # snapshots     : sequence of (valuation date, market data) couples in date order, the market
+    #                 data being an excel file (see mymarketdata) or a dict of dataframes
+    #                 'Strk', 'TtM', 'Call', 'Put', 'Spot', 'd_RfR' with maturities as columns
+    # out_path      : columnar output file (parquet, csv if pyarrow is not installed)
+    # kickout       : kickout barrier percentage of the spot of the valuation date
+    # protection    : protection barrier percentage
+    # I             : yearly interest over the nominal
+    # n_years       : number of yearly observation dates (first maturities after the date)
+    # N             : nominal value
+    # n_simu        : number of simulations by date
+    # seed          : seed of the common random numbers, the same paths are used on every date
+    # n_jobs        : number of worker processes ('-1' uses all the CPU cores, '-2' all but one)
+    # dates_by_task : number of consecutive dates priced by one task (None = spread over the workers)
+    # cache_dir     : folder of the on-disk calibration cache shared by the workers
+    #                 (None = 'res/.cache/calibration')
+
+    # OUTPUT:
+    # out           : number of dates written
+    #                 (one row by date: date, spot, barriers, price, std_err, mean vol and drift
+    #                  at the protection barrier, calibration and pricing times, market hash)
+
+    # Each date is repriced as a new contract struck at its spot. Tasks are runs of consecutive
+    # dates, so unchanged market data is calibrated once by worker (in-process cache) and once
+    # overall (on-disk cache); the rows are written as soon as the runs complete, in date order.
+
+    import os
+    from joblib import Parallel, delayed, effective_n_jobs
+
+    n_jobs = effective_n_jobs(n_jobs)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'res', '.cache', 'calibration')
+
+    # market data dicts shipped as plain in-memory frames (joblib would re-map the memory-mapped
+    # arrays of mymarketdata by file and offset, which does not survive the dataframe views)
+    snapshots = [(date, market if isinstance(market, str) else _inMemory(market)) for date, market in snapshots]
+    if dates_by_task is None:
+        dates_by_task = max(1, -(-len(snapshots) // (4 * n_jobs)))
+    tasks = [snapshots[i:i + int(dates_by_task)] for i in range(0, len(snapshots), int(dates_by_task))]
+    contract = dict(kickout=kickout, protection=protection, I=I, n_years=n_years, N=N, n_simu=n_simu, seed=seed)
+
+    ins.count('bt.dates', len(snapshots))
+    results = Parallel(n_jobs=n_jobs, return_as='generator')(delayed(_backtestTask)(task, contract, cache_dir) for task in tasks)
+
+    writer = _openWriter(out_path)
+    n_done = 0
+    try:
+        for rows in results:
+            _writeRows(writer, rows)
+            n_done += len(rows)
+    finally:
+        _closeWriter(writer)
+
+    return n_done
+
+
+def _backtestTask(snapshots, contract, cache_dir):
+
+    # INPUT:
+    # snapshots : run of (valuation date, market data) couples
+    # contract  : dict of the contract terms and simulation parameters (see backtest)
+    # cache_dir : folder of the on-disk calibration cache
+
+    # OUTPUT:
+    # out       : list of rows (dicts), one by date
+
+    import time
+    import mymarketdata as mkt
+    import mycalibration as cal
+    import myautocallable as acl
+    import myrandom as rnd
+
+    rng = rnd.counterRNG(contract['seed'])
+    rows = []
+    for date, market in snapshots:
+        starting_t = time.perf_counter()
+        if isinstance(market, str):
+            market = mkt.loadMarketData(market)
+
+        # contract struck at the spot of the date, observed at the next maturities
+        S_0 = float(market['Spot'].iloc[0, 0])
+        S_k = S_0 * contract['kickout']
+        S_p = S_0 * contract['protection']
+        TtM_row = market['TtM'].iloc[0]
+        t_steps = [t for t in TtM_row.index if TtM_row[t] > 0][:contract['n_years']]
+
+        InR, ImV, DsR, k_Drift, k_Vol, k_TtM = cal.calibrate(market, S_p, t_steps, 'C', cache_dir=cache_dir)
+        calibration_t = time.perf_counter() - starting_t
+
+        starting_t = time.perf_counter()
+        price, std_err, n_done = acl.streamingMonteCarloPrice(t_steps, k_TtM, k_Drift, k_Vol, DsR, S_0, S_k, S_p, contract['N'], contract['I'], contract['n_simu'], store=rng)
+        pricing_t = time.perf_counter() - starting_t
+
+        rows.append({'date': str(date), 'spot': S_0, 'S_k': S_k, 'S_p': S_p, 'price': price, 'std_err': std_err,
+                     'n_simu': n_done, 'vol': float(k_Vol[t_steps].mean()), 'drift': float(k_Drift[t_steps].mean()),
+                     'calibration_time': calibration_t, 'pricing_time': pricing_t, 'market_hash': cal.marketHash(market)[:16]})
+
+    return rows
+
+
+def _inMemory(market):
+
+    # INPUT:
+    # market : dict of dataframes (see mymarketdata.loadMarketData)
+
+    # OUTPUT:
+    # out    : same dict with the values copied into ordinary numpy arrays
+
+    import numpy as np
+    import pandas as pd
+
+    return {key: pd.DataFrame(np.array(df), index=df.index, columns=df.columns) for key, df in market.items()}
+
+
+def _openWriter(path):
+
+    # INPUT:
+    # path : output file
+
+    # OUTPUT:
+    # out  : writer state, rows are appended to a parquet file, one row group by call
+    #        (to a csv file without pyarrow)
+
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        import warnings
+        warnings.warn('pyarrow is not installed, writing csv instead of parquet')
+        return {'path': path, 'parquet': False, 'writer': None}
+
+    return {'path': path, 'parquet': True, 'writer': None}
+
+
+def _writeRows(writer, rows):
+
+    # INPUT:
+    # writer : writer state (see _openWriter)
+    # rows   : list of rows (dicts with the same keys)
+
+    if not rows:
+        return
+
+    if not writer['parquet']:
+        import pandas as pd
+        first = writer['writer'] is None
+        pd.DataFrame(rows).to_csv(writer['path'], mode='w' if first else 'a', header=first, index=False)
+        writer['writer'] = 'csv'
+        return
+
+    import pyarrow
+    import pyarrow.parquet
+
+    table = pyarrow.Table.from_pylist(rows)
+    if writer['writer'] is None:
+        writer['writer'] = pyarrow.parquet.ParquetWriter(writer['path'], table.schema)
+    writer['writer'].write_table(table)
+
+
+def _closeWriter(writer):
+    if writer['parquet'] and writer['writer'] is not None:
+        writer['writer'].close()
@@ -0,0 +1,439 @@
+def contractInputs(path=None, S_0=3042, kickout=1.10, protection=0.95, I=0.04, T=2020, t_0=2015, N=1):
+
+    # INPUT:
+    # path       : market data excel file (None = res/Data_Pricing.xlsx)
+    # S_0        : spot price
+    # kickout    : kickout barrier percentage
+    # protection : protection barrier percentage
+    # I          : interest
+    # T          : maturity
+    # t_0        : valuation date
+    # N          : nominal
+
+    # OUTPUT:
+    # out        : dict of the pricer inputs of the myapp contract
+
+    import os
+    import mymarketdata as mkt
+    import mycalibration as cal
+
+    if path is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'res', 'Data_Pricing.xlsx')
+
+    S_p = S_0 * protection
+    S_k = S_0 * kickout
+    t_steps = range(t_0+1, T+1)
+
+    # input from excel file (binary snapshot)
+    market = mkt.loadMarketData(path)
+
+    # vars estimation (cached)
+    InR, ImV, DsR, k_Drift, k_Vol, k_TtM = cal.calibrate(market, S_p, t_steps, 'C')
+
+    return dict(t_steps=t_steps, TtM=k_TtM, Drift=k_Drift, Vol=k_Vol, Disc=DsR, S_0=S_0, S_k=S_k, S_p=S_p, N=N, I=I)
+
+
+def benchmarkQMC(contract, r_simu=(2**10, 2**12, 2**14, 2**16), n_ref=int(1e7), n_runs=20, seed=0):
+
+    # INPUT:
+    # contract : dict of pricer inputs (see contractInputs)
+    # r_simu   : range of numbers of simulations
+    # n_ref    : number of simulations of the reference price
+    # n_runs   : number of independent runs by point
+    # seed     : seed of the runs
+
+    # OUTPUT:
+    # out      : dataframe of rmse and wall time for plain MC and QMC
+
+    import myautocallable as acl
+    import myqmc as qmc
+
+    ref_price, ref_se, _ = acl.streamingMonteCarloPrice(n_simu=n_ref, seed=seed, **contract)
+    print('Reference price =', ref_price, '+/-', ref_se)
+
+    return qmc.compareRMSE(r_simu=r_simu, ref_price=ref_price, n_runs=n_runs, seed=seed + 1, **contract)
+
+
+def benchmarkBlackScholes(n_options=int(1e6), seed=0):
+
+    # INPUT:
+    # n_options : size of the batch of options
+    # seed      : seed of the random option parameters
+
+    # OUTPUT:
+    # out       : dataframe of total and per-option time of the black&scholes kernels
+
+    import time
+    import numpy as np
+    import pandas as pd
+    import myblackscholes as bs
+
+    rng = np.random.default_rng(seed)
+    Spot = rng.uniform(2500, 3500, n_options)
+    Strk = rng.uniform(2500, 3500, n_options)
+    TtM = rng.uniform(0.1, 10, n_options)
+    InR = rng.uniform(-0.01, 0.03, n_options)
+    Sigma = rng.uniform(0.1, 0.4, n_options)
+
+    kernels = {
+        'callPrice': lambda: bs.callPrice(Spot, Strk, TtM, InR, Sigma),
+        'callPrice + vega': lambda: (bs.callPrice(Spot, Strk, TtM, InR, Sigma), bs.vega(Spot, Strk, TtM, InR, Sigma)),
+        'priceAndGreeks': lambda: bs.priceAndGreeks(Spot, Strk, TtM, InR, Sigma, 'C'),
+    }
+
+    rows = []
+    for name, kernel in kernels.items():
+        kernel() # warm up
+        starting_t = time.perf_counter()
+        kernel()
+        elapsed_t = time.perf_counter() - starting_t
+        rows.append({'kernel': name, 'n_options': n_options, 'time': elapsed_t, 'ns_per_option': elapsed_t / n_options * 1e9})
+
+    return pd.DataFrame(rows)
+
+
+def benchmarkBarrier(contract, r_obs=(4, 16, 64, 256, 1024), n_simu=int(1e6), seed=0, max_block=int(1e7)):
+
+    # INPUT:
+    # contract  : dict of pricer inputs (see contractInputs)
+    # r_obs     : range of numbers of observation dates by time step of the dense-grid reference
+    # n_simu    : number of simulations by price
+    # seed      : seed of the runs
+    # max_block : maximum number of random terms drawn at once
+
+    # OUTPUT:
+    # out       : dataframe of price, standard error and wall time of the continuously monitored
+    #             kick out by brownian bridge (weighted and sampled) on the time steps only, and
+    #             of the dense-grid references (a crossing redeemed at the next time step), whose
+    #             price converges to it as the number of observation dates grows, and of their
+    #             extrapolation to continuous monitoring
+
+    import time
+    import numpy as np
+    import pandas as pd
+    import myautocallable as acl
+    import mymlmc as ml
+
+    n_steps = len(contract['t_steps'])
+    rows = []
+
+    def add(method, n_obs, price, std_err, elapsed_t):
+        rows.append({'method': method, 'n_obs': n_obs, 'price': price, 'std_err': std_err, 'time': elapsed_t})
+
+    for method in ('bridge', 'bridge sampled'):
+        rng = np.random.default_rng(seed)
+        starting_t = time.perf_counter()
+        RND = rng.standard_normal((n_simu, n_steps))
+        U = rng.random((n_simu, n_steps)) if method == 'bridge sampled' else None
+        payoffs = acl.vectorizedPayoff(RND=RND, monitoring='continuous', U=U, **contract)
+        add(method, 1, payoffs.mean(), payoffs.std(ddof=1) / np.sqrt(n_simu), time.perf_counter() - starting_t)
+
+    for n_obs in r_obs:
+        ts = ml.monitoringDates(contract['t_steps'], contract['TtM'], contract['Drift'], contract['Vol'], contract['Disc'], n_obs)
+        ts_steps = acl.termStructure(contract['t_steps'], contract['TtM'], contract['Drift'], contract['Vol'], contract['Disc'])
+        rng = np.random.default_rng(seed)
+        stats = (0, 0.0, 0.0)
+        starting_t = time.perf_counter()
+        while stats[0] < n_simu:
+            n_block = min(n_simu - stats[0], max(1, max_block // len(ts.TtM)))
+            S = contract['S_0'] * np.exp(np.cumsum(ts.drift_dt + ts.vol_sqrt_dt * rng.standard_normal((n_block, len(ts.TtM))), axis=1))
+            # kick out at a time step if any of its dates is above the barrier
+            kicked = S.reshape(n_block, n_steps, n_obs).max(axis=2) >= contract['S_k']
+            touched = kicked.any(axis=1)
+            t_ko = kicked.argmax(axis=1)
+            payoffs = np.where(S[:, -1] > contract['S_p'], 1.0, S[:, -1] / contract['S_0']) * ts_steps.disc[-1]
+            payoffs[touched] = (1 + ts_steps.TtM[t_ko[touched]] * contract['I']) * ts_steps.disc[t_ko[touched]]
+            stats = acl.mergeStats(stats, acl.chunkStats(payoffs))
+        add('dense grid', n_obs, stats[1], acl.stdErr(stats), time.perf_counter() - starting_t)
+
+    # discrete monitoring converges in 1 / sqrt(n_obs): extrapolation of the two densest grids
+    if len(r_obs) > 1:
+        (n_1, p_1, se_1), (n_2, p_2, se_2) = [(r['n_obs'], r['price'], r['std_err']) for r in rows[-2:]]
+        c = 1 / (np.sqrt(n_2 / n_1) - 1)
+        add('dense grid extrapolated', np.inf, p_2 + c * (p_2 - p_1), np.sqrt(((1 + c) * se_2) ** 2 + (c * se_1) ** 2), np.nan)
+
+    return pd.DataFrame(rows)
+
+
+# modules that only the backends needing them should load
+HEAVY_MODULES = ('pandas', 'scipy', 'joblib', 'pyspark', 'matplotlib', 'numba')
+
+
+def benchmarkImports(modules=('myautocallable', 'myfinutils', 'myblackscholes', 'mygreeks', 'myqmc', 'myvariance', 'myportfolio', 'mymarketdata', 'mycalibration', 'myservice'), n_runs=5):
+
+    # INPUT:
+    # modules : modules imported, each one in a fresh interpreter
+    # n_runs  : number of fresh interpreters by module (the best time is kept)
+
+    # OUTPUT:
+    # out     : dataframe of import time and interpreter start-to-exit time (s) by module,
+    #           with the heavy modules loaded by the import
+
+    import os
+    import sys
+    import time
+    import subprocess
+    import pandas as pd
+
+    code = ('import sys, time; t = time.perf_counter(); import {0}; t = time.perf_counter() - t; '
+            'print(t); print(" ".join(k for k in {1!r} if k in sys.modules))')
+
+    rows = []
+    for module in modules:
+        best = (float('inf'), float('inf'), '')
+        for _ in range(n_runs):
+            starting_t = time.perf_counter()
+            out = subprocess.check_output([sys.executable, '-c', code.format(module, HEAVY_MODULES)], cwd=os.path.dirname(os.path.abspath(__file__)))
+            elapsed_t = time.perf_counter() - starting_t
+            import_t, heavy = (out.decode().splitlines() + [''])[:2]
+            best = min(best, (float(import_t), elapsed_t, heavy))
+        rows.append({'module': module, 'import_time': best[0], 'process_time': best[1], 'heavy_modules': best[2]})
+
+    return pd.DataFrame(rows)
+
+
+# backend -> largest number of paths benchmarked by default
+BACKENDS = {
+    'serial': int(1e5),
+    'vectorized': int(1e7),
+    'streaming': int(1e7),
+    'joblib': int(1e7),
+    'spark': int(1e7),
+    'qmc': int(1e7),
+    'numba': int(1e7),
+}
+
+
+def referencePrice(contract, n_simu=2**20, n_replicates=16, seed=0):
+
+    # INPUT:
+    # contract     : dict of pricer inputs (see contractInputs)
+    # n_simu       : number of simulations by replicate
+    # n_replicates : number of randomized QMC replicates
+
+    # OUTPUT:
+    # price        : high precision price (randomized sobol with brownian bridge)
+    # std_err      : its standard error
+    # payoff_std   : standard deviation of the payoff (standard error of plain MC backends)
+
+    import numpy as np
+    import myautocallable as acl
+    import myqmc as qmc
+
+    price, std_err = qmc.quasiMonteCarloPrice(n_simu=n_simu * n_replicates, n_replicates=n_replicates, seed=seed, **contract)
+    payoffs = acl.vectorizedPayoff(RND=np.random.default_rng(seed).standard_normal((2**16, len(contract['t_steps']))), **contract)
+
+    return price, std_err, float(payoffs.std(ddof=1))
+
+
+def benchmarkSuite(contract, backends=tuple(BACKENDS), r_simu=(int(1e3), int(1e4), int(1e5), int(1e6), int(1e7)), r_workers=None, out_path=None, seed=0):
+
+    # INPUT:
+    # contract  : dict of pricer inputs (see contractInputs)
+    # backends  : backends to benchmark (see BACKENDS)
+    # r_simu    : range of numbers of simulations (capped by backend, see BACKENDS)
+    # r_workers : range of numbers of workers for joblib and spark (None = 1, 2, 4... up to the cores)
+    # out_path  : json file where the results are written (None = not written)
+    # seed      : seed of the runs
+
+    # OUTPUT:
+    # out       : dict of the environment, the reference price and one record by run with
+    #             throughput (paths/s), peak rss, price, standard error and error over the reference
+
+    # Every run is done in a fresh process, so that its peak rss is not polluted by the
+    # previous runs and no compiled kernel or spark context is reused.
+
+    import os
+    import json
+    import time
+    import platform
+    import multiprocessing
+    import numpy as np
+
+    if r_workers is None:
+        r_workers = [2 ** k for k in range(int(np.log2(os.cpu_count() or 1)) + 1)]
+
+    ref_price, ref_se, payoff_std = referencePrice(contract, seed=seed)
+    print('Reference price =', ref_price, '+/-', ref_se)
+
+    runs = []
+    ctx = multiprocessing.get_context('spawn')
+    for backend in backends:
+        for n_simu in r_simu:
+            if n_simu > BACKENDS[backend]:
+                continue
+            for n_workers in (r_workers if backend in ('joblib', 'spark') else [1]):
+                with ctx.Pool(1) as pool:
+                    run = pool.apply(_benchmarkRun, (backend, contract, int(n_simu), n_workers, seed))
+                if 'price' in run:
+                    if run['std_err'] is None:
+                        run['std_err'] = float(payoff_std / np.sqrt(n_simu))
+                    run['error'] = run['price'] - ref_price
+                    run['z_score'] = float(run['error'] / np.sqrt(run['std_err'] ** 2 + ref_se ** 2))
+                print(run)
+                runs.append(run)
+
+    results = dict(
+        timestamp=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        version=_gitVersion(),
+        platform=platform.platform(),
+        python=platform.python_version(),
+        cpu_count=os.cpu_count(),
+        reference=dict(price=ref_price, std_err=ref_se),
+        runs=runs)
+
+    if out_path is not None:
+        with open(out_path, 'w') as f:
+            json.dump(results, f, indent=1, default=float)
+
+    return results
+
+
+def compareResults(old, new, max_slowdown=1.25, max_z=4.0):
+
+    # INPUT:
+    # old, new     : results of benchmarkSuite (dict or json file path)
+    # max_slowdown : throughput ratio old / new above which a run is a performance regression
+    # max_z        : |z-score| over the reference above which a run is an accuracy regression
+
+    # OUTPUT:
+    # out          : dataframe of the runs found in both results with the regression flags
+
+    import json
+    import pandas as pd
+
+    def load(results):
+        if isinstance(results, str):
+            with open(results) as f:
+                results = json.load(f)
+        runs = pd.DataFrame(results['runs'])
+        return runs[~runs['throughput'].isna()] if 'throughput' in runs else runs.iloc[:0]
+
+    key = ['backend', 'n_simu', 'n_workers']
+    out = load(old).merge(load(new), on=key, suffixes=('_old', '_new'))
+    out['slowdown'] = out['throughput_old'] / out['throughput_new']
+    out['perf_regression'] = out['slowdown'] > max_slowdown
+    out['accuracy_regression'] = out['z_score_new'].abs() > max_z
+
+    return out[key + ['throughput_old', 'throughput_new', 'slowdown', 'perf_regression', 'z_score_old', 'z_score_new', 'accuracy_regression']]
+
+
+def _benchmarkRun(backend, contract, n_simu, n_workers, seed):
+
+    # INPUT:
+    # backend   : backend name (see BACKENDS)
+    # contract  : dict of pricer inputs
+    # n_simu    : number of simulations
+    # n_workers : number of workers (joblib and spark)
+    # seed      : seed of the run
+
+    # OUTPUT:
+    # out       : dict of the run record (std_err None when the backend does not estimate it)
+
+    import time
+    import numpy as np
+    import myautocallable as acl
+
+    run = dict(backend=backend, n_simu=n_simu, n_workers=n_workers)
+
+    def price(n_simu):
+        # (price, std_err) by backend
+        if backend == 'serial':
+            np.random.seed(seed)
+            return acl.monteCarloStats(n_simu=n_simu, RND=None, **contract)[:2]
+        elif backend == 'vectorized':
+            np.random.seed(seed)
+            return acl.vectorizedMonteCarloPrice(n_simu=n_simu, RND=None, **contract), None
+        elif backend == 'streaming':
+            return acl.streamingMonteCarloPrice(n_simu=n_simu, seed=seed, **contract)[:2]
+        elif backend == 'joblib':
+            return acl.parallelMonteCarloStats(n_simu=n_simu, RND=None, n_jobs=n_workers, seed=seed, **contract)[:2]
+        elif backend == 'spark':
+            return acl.distribuitedMonteCarloStats(1.0, [], sc=sc, n_simu=n_simu, seed=seed, **contract)[:2]
+        elif backend == 'qmc':
+            import myqmc as qmc
+            return qmc.quasiMonteCarloPrice(n_simu=n_simu, n_replicates=min(16, n_simu), seed=seed, **contract)
+        elif backend == 'numba':
+            import myjit
+            if not myjit.available():
+                raise ImportError('numba is not installed')
+            return myjit.jitMonteCarloPrice(n_simu=n_simu, seed=seed, **contract)
+        raise ValueError('unknown backend ' + backend)
+
+    try:
+        if backend == 'spark':
+            sc = acl.startDistribuitedEnvironment('local[' + str(n_workers) + ']')
+
+        # imports, compilation and worker start-up are not timed
+        price(min(n_simu, 100))
+        starting_t = time.perf_counter()
+        value, std_err = price(n_simu)
+        elapsed_t = time.perf_counter() - starting_t
+
+        if backend == 'spark':
+            sc.stop()
+    except ImportError as e:
+        run['skipped'] = str(e)
+        return run
+
+    run.update(price=float(value), std_err=None if std_err is None else float(std_err), time=elapsed_t,
+               throughput=n_simu / elapsed_t, peak_rss_mb=_peakRSS())
+    return run
+
+
+def _peakRSS():
+
+    # OUTPUT:
+    # out : peak resident set size of the process in MB
+
+    import resource
+
+    # VmHWM is reset by exec, ru_maxrss is inherited from the parent process
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _gitVersion():
+
+    # OUTPUT:
+    # out : git commit of the benchmarked code (None outside a git repository)
+
+    import os
+    import subprocess
+
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='benchmarks of the pricing backends')
+    parser.add_argument('what', nargs='?', default='suite', choices=['suite', 'qmc', 'bs', 'imports', 'barrier'])
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument('--n-simu', nargs='+', type=float, default=[1e3, 1e4, 1e5, 1e6, 1e7])
+    parser.add_argument('--workers', nargs='+', type=int, default=None)
+    parser.add_argument('--out', default='bench_results.json')
+    parser.add_argument('--compare', default=None, help='previous json results to check for regressions')
+    args = parser.parse_args()
+
+    if args.what == 'bs':
+        print(benchmarkBlackScholes().to_string(index=False))
+    elif args.what == 'imports':
+        print(benchmarkImports().to_string(index=False))
+    elif args.what == 'barrier':
+        print(benchmarkBarrier(contractInputs()).to_string(index=False))
+    elif args.what == 'qmc':
+        print(benchmarkQMC(contractInputs()).to_string(index=False))
+    else:
+        results = benchmarkSuite(contractInputs(), args.backends, [int(n) for n in args.n_simu], args.workers, args.out)
+        if args.compare is not None:
+            print(compareResults(args.compare, results).to_string(index=False))
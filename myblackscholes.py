@@ -1,5 +1,8 @@
+import numpy as np
+
+
 def callPrice(Spot, Strk, TtM, InR, Sigma):
-    
+
     # INPUT
     # Spot  : spot price
     # Strk  : strike price
@@ -10,17 +13,13 @@ def callPrice(Spot, Strk, TtM, InR, Sigma):
     # OUTPUT
     # out   : call price
 
-    from numpy import log, exp, sqrt
-    from scipy.stats import norm
-    
-    d1 = (log(Spot / Strk) + (InR + 0.5 * Sigma ** 2) * TtM) / (Sigma * sqrt(TtM))
-    d2 = (log(Spot / Strk) + (InR - 0.5 * Sigma ** 2) * TtM) / (Sigma * sqrt(TtM))
-    
-    return (Spot * norm.cdf(d1, 0.0, 1.0) - Strk * exp(-InR * TtM) * norm.cdf(d2, 0.0, 1.0))
+    d1, d2 = _d1d2(Spot, Strk, TtM, InR, Sigma)
+
+    return (Spot * normCdf(d1) - Strk * np.exp(-InR * TtM) * normCdf(d2))
 
 
 def putPrice(Spot, Strk, TtM, InR, Sigma):
-     
+
     # INPUT
     # Spot  : spot price
     # Strk  : strike price
@@ -29,19 +28,15 @@ def putPrice(Spot, Strk, TtM, InR, Sigma):
     # Sigma : volatility
 
     # OUTPUT
-    # out   : call price
-   
-    from numpy import log, exp, sqrt
-    from scipy.stats import norm
-    
-    d1 = (log(Spot / Strk) + (InR + 0.5 * Sigma ** 2) * TtM) / (Sigma * sqrt(TtM))
-    d2 = (log(Spot / Strk) + (InR - 0.5 * Sigma ** 2) * TtM) / (Sigma * sqrt(TtM))
+    # out   : put price
+
+    d1, d2 = _d1d2(Spot, Strk, TtM, InR, Sigma)
 
-    return (Strk * exp(-InR * TtM) * norm.cdf(-d2, 0.0, 1.0) - Spot * norm.cdf(-d1, 0.0, 1.0))
+    return (Strk * np.exp(-InR * TtM) * normCdf(-d2) - Spot * normCdf(-d1))
 
 
 def vega(Spot, Strk, TtM, InR, Sigma):
-    
+
     # INPUT
     # Spot  : spot price
     # Strk  : strike price
@@ -50,11 +45,76 @@ def vega(Spot, Strk, TtM, InR, Sigma):
     # Sigma : volatility
 
     # OUTPUT
-    # out   : call price
+    # out   : vega (same for call and put)
+
+    d1, d2 = _d1d2(Spot, Strk, TtM, InR, Sigma)
+
+    return Spot * np.sqrt(TtM) * _normPdf(d1)
+
+
+def priceAndGreeks(Spot, Strk, TtM, InR, Sigma, flag='C'):
+
+    # INPUT
+    # Spot  : spot price
+    # Strk  : strike price
+    # TtM   : time to maturity
+    # InRn  : interest rate
+    # Sigma : volatility
+    # flag  : 'C' if call option 'P' if put option
+    # (numpy arrays of any broadcastable shape)
+
+    # OUTPUT
+    # out   : price, delta, gamma, vega, theta, rho computed on shared intermediates
+
+    Spot, Strk, TtM, InR, Sigma = [np.asarray(X, dtype=float) for X in (Spot, Strk, TtM, InR, Sigma)]
+
+    sqrt_T = np.sqrt(TtM)
+    sig_sqrt_T = Sigma * sqrt_T
+    d1 = (np.log(Spot / Strk) + (InR + 0.5 * Sigma ** 2) * TtM) / sig_sqrt_T
+    d2 = d1 - sig_sqrt_T
+    pdf_d1 = _normPdf(d1)
+    K_disc = Strk * np.exp(-InR * TtM)
+
+    if flag == 'C': # call
+        N_d1 = normCdf(d1)
+        N_d2 = normCdf(d2)
+        price = Spot * N_d1 - K_disc * N_d2
+        delta = N_d1
+        theta = - Spot * pdf_d1 * Sigma / (2 * sqrt_T) - InR * K_disc * N_d2
+        rho = TtM * K_disc * N_d2
+    elif flag == 'P': # put
+        N_d1 = normCdf(-d1)
+        N_d2 = normCdf(-d2)
+        price = K_disc * N_d2 - Spot * N_d1
+        delta = - N_d1
+        theta = - Spot * pdf_d1 * Sigma / (2 * sqrt_T) + InR * K_disc * N_d2
+        rho = - TtM * K_disc * N_d2
+    else: # error
+        raise ValueError("flag must be 'C' or 'P'")
+
+    gamma = pdf_d1 / (Spot * sig_sqrt_T)
+    vega = Spot * sqrt_T * pdf_d1
+
+    return price, delta, gamma, vega, theta, rho
+
+
+def _d1d2(Spot, Strk, TtM, InR, Sigma):
+
+    sig_sqrt_T = Sigma * np.sqrt(TtM)
+    d1 = (np.log(Spot / Strk) + (InR + 0.5 * Sigma ** 2) * TtM) / sig_sqrt_T
+
+    return d1, d1 - sig_sqrt_T
+
+
+def normCdf(x):
+
+    # standard normal cdf through the error function
+    from scipy.special import erf
+
+    return 0.5 * (1.0 + erf(x * 0.7071067811865476))
 
-    from scipy.stats import norm
-    from numpy import log, sqrt
 
-    d1 = (log(Spot / Strk) + (InR + 0.5 * Sigma ** 2) * TtM) / (Sigma * sqrt(TtM))
+def _normPdf(x):
 
-    return Spot * sqrt(TtM) * norm.cdf(d1)
\ No newline at end of file
+    # standard normal density
+    return 0.3989422804014327 * np.exp(-0.5 * x * x)
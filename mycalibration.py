@@ -0,0 +1,169 @@
+import collections
+import myinstrument as ins
+
+# in-process layer: key -> calibrated values, least recently used first
+_LRU = collections.OrderedDict()
+LRU_SIZE = 64
+
+
+@ins.instrumented('cal.calibrate')
+def calibrate(market, S_p, t_steps, flag='C', cache_dir=None, max_bytes=64 * 2**20):
+
+    # INPUT:
+    # market    : dict of dataframes 'Strk', 'TtM', 'Call', 'Put', 'Spot', 'd_RfR' (see mymarketdata)
+    # S_p       : protection barrier (strike at which drift and vol are interpolated)
+    # t_steps   : time steps
+    # flag      : 'C' if call option 'P' if put option is used for implied vol
+    # cache_dir : folder of the on-disk layer (None = in-process layer only)
+    # max_bytes : size of the on-disk layer above which the least recently used entries are evicted
+
+    # OUTPUT:
+    # InR       : interest rate surface
+    # ImV       : implied volatility surface
+    # DsR       : discount rate by time
+    # k_Drift   : drift by time interpolated at S_p
+    # k_Vol     : volatility by time interpolated at S_p
+    # k_TtM     : time to maturity by time
+
+    import numpy as np
+    import myfinutils as fin
+
+    data_key = marketHash(market)
+
+    # surface, shared by all the contracts on the same market data
+    def calibrateSurface():
+        InR = fin.interestRate(market['Call'], market['Put'], market['Spot'], market['Strk'], market['TtM'])
+        Target = market['Call'] if flag == 'C' else market['Put']
+        ImV = fin.impliedVolatilitySurface(Target, flag, market['Spot'], market['Strk'], market['TtM'], InR)
+        DsR = market['d_RfR'].iloc[0] * np.sqrt(365)
+        return InR, ImV, DsR
+    InR, ImV, DsR = _cached(('surface', data_key, flag), calibrateSurface, cache_dir, max_bytes)
+
+    # interpolation at the barrier of the contract
+    def interpolate():
+        S = market['Strk'][t_steps[0]]
+        k_Drift = fin.interpolateOnStrike(InR, S, S_p)
+        k_Vol = fin.interpolateOnStrike(ImV, S, S_p)
+        k_TtM = market['TtM'].iloc[0] # constant over strike value
+        return k_Drift, k_Vol, k_TtM
+    k_Drift, k_Vol, k_TtM = _cached(('strike', data_key, flag, float(S_p), t_steps[0]), interpolate, cache_dir, max_bytes)
+
+    return InR, ImV, DsR, k_Drift, k_Vol, k_TtM
+
+
+def marketHash(market):
+
+    # INPUT:
+    # market : dict of dataframes
+
+    # OUTPUT:
+    # out    : sha256 hex digest of the labels and values
+
+    import hashlib
+    import numpy as np
+
+    h = hashlib.sha256()
+    for key in sorted(market):
+        h.update(key.encode())
+        h.update(repr(list(market[key].columns)).encode())
+        h.update(np.ascontiguousarray(market[key].to_numpy(dtype=float)).tobytes())
+
+    return h.hexdigest()
+
+
+def clearCache(cache_dir=None):
+
+    # INPUT:
+    # cache_dir : folder of the on-disk layer to empty (None = in-process layer only)
+
+    import os
+    import glob
+
+    _LRU.clear()
+    if cache_dir is not None:
+        for path in glob.glob(os.path.join(cache_dir, '*.pkl')):
+            os.remove(path)
+
+
+def _cached(key, compute, cache_dir, max_bytes):
+
+    # INPUT:
+    # key       : tuple identifying the result
+    # compute   : function computing the result on a miss
+    # cache_dir : folder of the on-disk layer (None = in-process layer only)
+    # max_bytes : size limit of the on-disk layer
+
+    # OUTPUT:
+    # out       : result, from memory, from disk or computed
+
+    import os
+    import pickle
+    import hashlib
+
+    # in-process layer
+    if key in _LRU:
+        _LRU.move_to_end(key)
+        ins.count('cal.hits.memory')
+        return _LRU[key]
+
+    # on-disk layer
+    path = None
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, hashlib.sha256(repr(key).encode()).hexdigest()[:32] + '.pkl')
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            os.utime(path) # mark as recently used
+        except (OSError, pickle.UnpicklingError, EOFError):
+            value = None
+        if value is not None:
+            _remember(key, value)
+            ins.count('cal.hits.disk')
+            return value
+
+    ins.count('cal.misses')
+    value = compute()
+    _remember(key, value)
+
+    if path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        _evict(cache_dir, max_bytes)
+
+    return value
+
+
+def _remember(key, value):
+    _LRU[key] = value
+    _LRU.move_to_end(key)
+    while len(_LRU) > LRU_SIZE:
+        _LRU.popitem(last=False)
+
+
+def _evict(cache_dir, max_bytes):
+
+    # removes the least recently used files until the folder fits in max_bytes
+
+    import os
+    import glob
+
+    entries = []
+    for path in glob.glob(os.path.join(cache_dir, '*.pkl')):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
@@ -1,3 +1,9 @@
+import numpy as np
+import myblackscholes as bs
+import myinstrument as ins
+
+
+@ins.instrumented('fin.interestRate')
 def interestRate(Call, Put, Spot, Strk, TtM):
 
     # INPUT
@@ -10,8 +16,6 @@ def interestRate(Call, Put, Spot, Strk, TtM):
     # OUTPUT
     # out  : interest rate
 
-    import numpy as np 
-
     return np.log(Strk / (Spot + Put - Call)) / TtM
 
 
@@ -28,36 +32,81 @@ def impliedVolatility(target, flag, spot, strk, ttM, inR):
     # OUTPUT:
     # sigma  : implied volatility
 
-    import myblackscholes as bs
-    import numpy as np
-    import pandas as pd 
-
-    MAX_ITER = 100
-    MAX_ERROR = 1.0e-5
-
-    sigma = 0.5
-    i = 0
-    while (i < MAX_ITER):
-        if flag == 'C': # call
-            price = bs.callPrice(spot, strk, ttM, inR, sigma)
-        elif flag == 'P': # put
-            price = bs.putPrice(spot, strk, ttM, inR, sigma)
-        else: # error
-            price = target * 0 
+    sigma, converged, n_iter = impliedVolatilityArray(target, flag, spot, strk, ttM, inR)
 
-        vega = bs.vega(spot, strk, ttM, inR, sigma)
-        diff = target - price
+    # return best value so far
+    return float(sigma)
 
-        if (abs(diff) < MAX_ERROR):
-            return sigma # vol
 
-        sigma = sigma + diff / vega
-        i += 1
-
-    # return best value so far
-    return sigma
+@ins.instrumented('fin.impliedVolatilityArray')
+def impliedVolatilityArray(Target, flag, Spot, Strk, TtM, InR, MAX_ITER=100, MAX_ERROR=1.0e-5, MIN_VEGA=1.0e-8):
 
+    # INPUT: 
+    # Target    : target prices (Call or Put), array of any shape
+    # flag      : 'C' if call option 'P' if put option
+    # Spot      : spot prices
+    # Strk      : strike prices
+    # TtM       : times to maturity
+    # InR       : interest rates
+    # MAX_ITER  : maximum number of iterations
+    # MAX_ERROR : tolerance on the price
+    # MIN_VEGA  : below it the newton step is replaced by a bisection step
 
+    # OUTPUT:
+    # Sigma     : implied volatilities (best value so far where not converged,
+    #             NaN where the target price is missing)
+    # converged : True where the price is matched within MAX_ERROR
+    # n_iter    : number of iterations by cell
+
+    if flag not in ('C', 'P'): # error
+        raise ValueError("flag must be 'C' or 'P'")
+
+    Target, Spot, Strk, TtM, InR = np.broadcast_arrays(*[np.asarray(X, dtype=float) for X in (Target, Spot, Strk, TtM, InR)])
+    shape = Target.shape
+    Target, Spot, Strk, TtM, InR = [X.ravel() for X in (Target, Spot, Strk, TtM, InR)]
+
+    # newton from 0.5, safeguarded by a bracket on the volatility (price increases with sigma)
+    Sigma = np.where(np.isfinite(Target), 0.5, np.nan)
+    low = np.zeros(Target.shape)
+    high = 5.0 * np.ones(Target.shape)
+    converged = np.zeros(Target.shape, dtype=bool)
+    n_iter = np.zeros(Target.shape, dtype=int)
+
+    # only the unconverged cells are updated at each iteration
+    active = np.flatnonzero(np.isfinite(Target))
+    for i in range(MAX_ITER):
+        if active.size == 0:
+            break
+        sigma = Sigma[active]
+        price, delta, gamma, vega, theta, rho = bs.priceAndGreeks(Spot[active], Strk[active], TtM[active], InR[active], sigma, flag)
+        diff = Target[active] - price
+        n_iter[active] += 1
+
+        done = np.abs(diff) < MAX_ERROR
+        converged[active[done]] = True
+
+        # shrink the bracket
+        low[active] = np.where(diff > 0, sigma, low[active])
+        high[active] = np.where(diff < 0, sigma, high[active])
+
+        # newton step, bisection where vega vanishes or the step leaves the bracket
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = sigma + diff / vega
+        bisect = (vega < MIN_VEGA) | ~(step > low[active]) | ~(step < high[active])
+        step[bisect] = 0.5 * (low[active] + high[active])[bisect]
+
+        Sigma[active[~done]] = step[~done]
+        active = active[~done]
+
+    if ins.enabled():
+        ins.count('iv.solves', Target.size)
+        ins.count('iv.iterations', int(n_iter.sum()))
+        ins.count('iv.unconverged', int((~converged).sum()))
+
+    return Sigma.reshape(shape), converged.reshape(shape), n_iter.reshape(shape)
+
+
+@ins.instrumented('fin.impliedVolatilitySurface')
 def impliedVolatilitySurface(Target, flag, Spot, Strk, TtM, InR):
 
     # INPUT: 
@@ -71,71 +120,26 @@ def impliedVolatilitySurface(Target, flag, Spot, Strk, TtM, InR):
     # OUTPUT:
     # Sigma  : implied volatility surface
     
-    import myblackscholes as bs
-    import numpy as np
     import pandas as pd 
 
-    # initializes dataframe at 0.5
-    Sigma_col = Target.columns
-    Sigma = pd.DataFrame(0.5 * np.ones(Target.shape), columns=Sigma_col)
-    for i in range(0, Sigma.shape[0]):
-        for t in Sigma_col:
-            Sigma[t][i] = impliedVolatility(Target[t][i], flag, Spot[t][i], Strk[t][i], TtM[t][i], InR[t][i])
+    # whole surface solved at once
+    Sigma, converged, n_iter = impliedVolatilityArray(Target, flag, Spot, Strk, TtM, InR)
 
-    return Sigma
-    
+    return pd.DataFrame(Sigma, index=Target.index, columns=Target.columns)
 
-'''
-def parallelImpliedVolatilitySurface(Target, opt_flag, Spot, Strk, TtM, InR):
 
-    # INPUT: 
-    # target : target price (Call or Put)
-    # opt_flag : 'C' if call option 'P' if put option
-    # Spot   : spot price
-    # Strk   : strike price
-    # TtM    : time to maturity
-    # InR    : interest rate
-
-    # OUTPUT:
-    # Sigma  : implied volatility
-
-    import myblackscholes as bs
-    import numpy as np
-    import pandas as pd 
+def interpolateOnStrike(X, Strk, S_p):
 
-    MAX_ITER = 100
-    MAX_ERROR = 1.0e-5
+    # INPUT:
+    # X    : dataframe of a variable by strike (rows) and time (columns)
+    # Strk : strike prices of the rows (increasing)
+    # S_p  : strike at which the variable is interpolated
 
-    Sigma = pd.DataFrame(0.5 * np.ones(Target.shape), columns=Target.columns)
-    FLAG = (Sigma == 0.5)
-    print(FLAG)
-    Price = Target * 0
-    Vega = Target * 0
-
-    i = 0
-    while (i < MAX_ITER):
-        if opt_flag == 'C': # call
-            Price[FLAG] = bs.callPrice(Spot[FLAG], Strk[FLAG], TtM[FLAG], InR[FLAG], Sigma[FLAG])
-        elif opt_flag == 'P': # put
-            Price = bs.putPrice(Spot, Strk, TtM, InR, Sigma)
-        else: # error
-            return Target * 0
-
-        Vega[FLAG] = bs.vega(Spot[FLAG], Strk[FLAG], TtM[FLAG], InR[FLAG], Sigma[FLAG])
-        Diff = Target - Price
-        FLAG = Diff.abs() > MAX_ERROR
-
-        # debug
-        print('i =', i)
-        print(Diff)
-
-        if (FLAG.any(axis=None) == False):
-            return Sigma # vol
-
-        Sigma[FLAG] = Sigma[FLAG] + Diff[FLAG] / Vega[FLAG]
-        i += 1
+    # OUTPUT:
+    # out  : series by time linearly interpolated between the two closest strikes
 
-    # return best value so far
-    return Sigma
+    # find key-values to interpolate from dataframes (first strike above S_p)
+    S = np.asarray(Strk, dtype=float)
+    i = int(np.searchsorted(S, S_p))
 
-'''
\ No newline at end of file
+    return (X.iloc[i] * (S_p - S[i-1]) + X.iloc[i-1] * (S[i] - S_p)) / (S[i] - S[i-1])
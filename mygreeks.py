@@ -1,4 +1,11 @@
-def computePricesForGreek(greekFlag, t_steps, TtM, Drift, Vol, DsR, S_0, S_k, S_p, N, I, r_param, n_simu, sc):
+import numpy as np
+import myautocallable as acl
+import myinstrument as ins
+import mypathstore as pst
+
+
+@ins.instrumented('greeks.computePricesForGreek')
+def computePricesForGreek(greekFlag, t_steps, TtM, Drift, Vol, DsR, S_0, S_k, S_p, N, I, r_param, n_simu, sc=None, seed=None, RND=None, block_size=int(1e5)):
     # INPUT:
     # greekFlag : 'V' = Vega
     #             'D' = Delta
@@ -15,34 +22,207 @@ def computePricesForGreek(greekFlag, t_steps, TtM, Drift, Vol, DsR, S_0, S_k, S_
     # I       : yearly interest over the nominal
     # r_param : range of the parameters
     # n_simu  : number of simulation by monte carlo
-    # sc      : spark context
+    # sc      : spark context (None = local vectorized simulation)
+    # seed    : seed of the common random numbers
+    # RND     : common random terms of shape (n_simu, len(t_steps)) (None = generated,
+    #           PathStore = read from the memory maps by each worker, see mypathstore,
+    #           CounterRNG = generated by each worker from the path indices, see myrandom)
+    # block_size : number of paths repriced at once
 
     # OUTPUT:
     # prices  : list of prices
     # denoms  : parameter over wich the price is computed
 
-    import myautocallable as acl
-
-    prices = []
-    denoms = []
-
-    counter = 0
-    for param in r_param:
-        print(int(counter / len(r_param) * 100), '% of simulation')
-        prices.append(acl.distribuitedMonteCarloPrice(param, greekFlag, t_steps, TtM, Drift, Vol, DsR, S_0, S_k, S_p, N, I, sc, n_simu))
-        if greekFlag == 'V':
-            denoms.append(Vol.mean() * param)
-        elif greekFlag == 'D':
-            denoms.append(S_0 * param)
-        elif greekFlag == 'R':
-            denoms.append(Drift.mean() * param)
+    if greekFlag == 'V':
+        denoms = [Vol.mean() * param for param in r_param]
+    elif greekFlag == 'D':
+        denoms = [S_0 * param for param in r_param]
+    elif greekFlag == 'R':
+        denoms = [Drift.mean() * param for param in r_param]
+    else:
+        print('ERROR')
+        return 0, 0
+
+    prices, std_errs = scenarioPrices(greekFlag, t_steps, TtM, Drift, Vol, DsR, S_0, S_k, S_p, N, I, r_param, n_simu, sc, seed, RND, block_size)
+    return list(prices), denoms
+
+
+@ins.instrumented('greeks.scenarioPrices')
+def scenarioPrices(greekFlag, t_steps, TtM, Drift, Vol, DsR, S_0, S_k, S_p, N, I, r_param, n_simu, sc=None, seed=None, RND=None, block_size=int(1e5)):
+    # INPUT:
+    # (same as computePricesForGreek)
+
+    # OUTPUT:
+    # prices   : array of prices by bump, all simulated on the same paths
+    # std_errs : array of standard errors by bump
+
+    # bumped inputs with the scenario axis first
+    r_param = np.asarray(r_param, dtype=float)
+    TtM, Drift, Vol, DsR = acl.termArrays(t_steps, TtM, Drift, Vol, DsR)
+    scenarios = dict(TtM=TtM, Drift=Drift, Vol=Vol, Disc=DsR, S_0=S_0)
+    if greekFlag == 'V':
+        scenarios['Vol'] = r_param[:, None, None] * Vol
+    elif greekFlag == 'D':
+        scenarios['S_0'] = r_param[:, None] * S_0
+    elif greekFlag == 'R':
+        scenarios['Drift'] = r_param[:, None, None] * Drift
+    else:
+        raise ValueError("greekFlag must be 'V', 'D' or 'R'")
+
+    n_simu = int(n_simu)
+    entropy = np.random.SeedSequence(seed).entropy
+
+    # random terms of a store or of a counter-based generator are read in place, like generated ones
+    store = None
+    if acl.isSource(RND):
+        store, RND = RND, None
+        if isinstance(store, pst.PathStore):
+            n_simu = min(n_simu, store.n_simu)
+
+    if RND is not None:
+        # user supplied common random numbers
+        RND = np.asarray(RND, dtype=float)
+        sums = _scenarioSums(t_steps, scenarios, S_k, S_p, N, I, len(r_param), RND=RND, block_size=block_size)
+    elif sc is None:
+        sums = _scenarioSums(t_steps, scenarios, S_k, S_p, N, I, len(r_param), entropy, 0, n_simu, block_size=block_size, store=store)
+    else:
+        # distribuited computation, one batch of paths by partition
+        n_partitions = max(1, min(sc.defaultParallelism, n_simu))
+        sizes = [n_simu // n_partitions + (1 if p < n_simu % n_partitions else 0) for p in range(n_partitions)]
+        tasks = [(p, entropy, sizes[p], sum(sizes[:p])) for p in range(n_partitions)]
+        n_scenarios = len(r_param)
+
+        def sparkScenarioSums(iterator):
+            for p, entropy, n_paths, start in iterator:
+                yield _scenarioSums(t_steps, scenarios, S_k, S_p, N, I, n_scenarios, entropy, p, n_paths, block_size=block_size, store=store, start=start)
+
+        sums = sc.parallelize(tasks, n_partitions).mapPartitions(sparkScenarioSums).treeReduce(lambda a, b: (a[0] + b[0], a[1] + b[1], a[2] + b[2]))
+
+    total, total_sq, count = sums
+    prices = total / count
+    std_errs = np.sqrt(np.maximum(total_sq / count - prices ** 2, 0.0) / max(count - 1, 1))
+    return prices, std_errs
+
+
+def _scenarioSums(t_steps, scenarios, S_k, S_p, N, I, n_scenarios, entropy=None, p=0, n_paths=0, RND=None, block_size=int(1e5), store=None, start=0):
+    # INPUT:
+    # scenarios   : dict of TtM, Drift, Vol, Disc, S_0 (bumped inputs with the scenario axis first)
+    # n_scenarios : number of scenarios
+    # entropy, p  : seed entropy and stream index of the paths
+    # n_paths     : number of paths to generate
+    # RND         : random terms (replaces entropy, p and n_paths)
+    # store       : PathStore or CounterRNG the n_paths paths from start are read from
+    #               (replaces entropy, p)
+
+    # OUTPUT:
+    # out         : (sum, sum of squares, count) of the payoffs by scenario
+
+    if RND is not None:
+        n_paths = RND.shape[0]
+    elif store is None:
+        rng = np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(p,)))
+
+    total = np.zeros(n_scenarios)
+    total_sq = np.zeros(n_scenarios)
+    done = 0
+    while done < n_paths:
+        n_block = min(int(block_size), n_paths - done)
+        if RND is not None:
+            block = RND[done:done + n_block]
+        elif store is not None:
+            block = acl.readPaths(store, start + done, start + done + n_block, len(t_steps))
         else:
-            print('ERROR')
-            return 0, 0
-        counter += 1
+            block = rng.standard_normal((n_block, len(t_steps)))
+
+        # reprice every scenario on the same block of paths
+        payoffs = acl.vectorizedPayoff(t_steps, N=N, I=I, S_k=S_k, S_p=S_p, RND=block, **scenarios)
+        payoffs = np.broadcast_to(payoffs, (n_scenarios, n_block))
+        total += payoffs.sum(axis=1)
+        total_sq += (payoffs ** 2).sum(axis=1)
+        done += n_block
+
+    return total, total_sq, n_paths
+
+
+@ins.instrumented('greeks.likelihoodRatioGreeks')
+def likelihoodRatioGreeks(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, n_simu, seed=None, RND=None, block_size=int(1e5)):
+    # INPUT:
+    # t_steps : time steps
+    # TtM     : time to maturity
+    # Drift   : drift list by time
+    # Vol     : volatility list by time
+    # Disc    : discount rate
+    # S_0     : underlying initial value
+    # S_k     : kickout barrier
+    # S_p     : protection barrier
+    # N       : nominal value
+    # I       : yearly interest over the nominal
+    # n_simu  : number of simulation by monte carlo
+    # seed    : seed of the pseudo-random generator
+    # RND     : random terms of shape (n_simu, len(t_steps)) (None = generated)
+    # block_size : number of paths simulated at once
+
+    # OUTPUT:
+    # greeks   : dict of 'price', 'delta', 'gamma', 'vega', 'rho' estimated in one simulation
+    # std_errs : dict of their standard errors
+    # (vega and rho are sensitivities to a parallel shift of Vol and Drift)
+
+    # The kick-out and protection legs are digital in the path, so their pathwise derivative
+    # vanishes almost surely: the payoff is kept as is and the derivative moves onto the
+    # gaussian density of the log-increments (likelihood ratio). The only explicit
+    # dependence on the spot, S_t / S_0 under the protection barrier, is added pathwise.
+
+    TtM, Drift, Vol, Disc = acl.termArrays(t_steps, TtM, Drift, Vol, Disc)
+    dt = np.diff(TtM, prepend=0)
+    s = Vol * np.sqrt(dt) # std dev of the log-increments
+
+    names = ['price', 'delta', 'gamma', 'vega', 'rho']
+    total = np.zeros(len(names))
+    total_sq = np.zeros(len(names))
+    rng = np.random.default_rng(seed)
+
+    n_simu = int(n_simu) if RND is None else len(RND)
+    done = 0
+    while done < n_simu:
+        n_block = min(int(block_size), n_simu - done)
+        if RND is None:
+            Z = rng.standard_normal((n_block, len(t_steps)))
+        else:
+            Z = np.asarray(RND[done:done + n_block], dtype=float)
+
+        # underlying dynamics and first kick out date
+        S = S_0 * np.exp(np.cumsum((Drift - 0.5 * Vol ** 2) * dt + s * Z, axis=1))
+        kicked = S >= S_k
+        touched = kicked.any(axis=1)
+        t_ko = np.where(touched, kicked.argmax(axis=1), len(t_steps) - 1)
+
+        # discounted payoffs
+        g = acl.vectorizedPayoff(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, Z)
+        # explicit dependence on S_0 (S_t / S_0 leg)
+        ratio = ~touched & (S[:, -1] <= S_p)
+        g_S = np.where(ratio, - g / S_0, 0.0)
+        g_SS = np.where(ratio, 2 * g / S_0 ** 2, 0.0)
+
+        # scores, the increments after the kick out date have zero conditional mean and are dropped
+        alive = np.arange(len(t_steps)) <= t_ko[:, None]
+        score_S = Z[:, 0] / (s[0] * S_0)
+        score_SS = (Z[:, 0] ** 2 - 1 - s[0] * Z[:, 0]) / (s[0] * S_0) ** 2
+        score_V = ((Z ** 2 - 1) / Vol - Z * np.sqrt(dt)) * alive
+        score_R = (Z * np.sqrt(dt) / Vol) * alive
+
+        samples = np.stack([
+            g,
+            g * score_S + g_S,
+            g * score_SS + 2 * g_S * score_S + g_SS,
+            g * score_V.sum(axis=1),
+            g * score_R.sum(axis=1)])
+        total += samples.sum(axis=1)
+        total_sq += (samples ** 2).sum(axis=1)
+        done += n_block
 
-    print(int(counter / len(r_param) * 100), '% of simulation')
-    return prices, denoms
+    means = total / n_simu
+    std_errs = np.sqrt(np.maximum(total_sq / n_simu - means ** 2, 0.0) / max(n_simu - 1, 1))
+    return dict(zip(names, means.tolist())), dict(zip(names, std_errs.tolist()))
 
 
 def derivateGreek(num, denom):
@@ -0,0 +1,191 @@
+import os
+import time
+import functools
+import contextlib
+
+# instrumentation state, switched on by enable() or by the environment variable AUTOCALL_METRICS=1
+# (when disabled every hook returns at the first test)
+_STATE = {'enabled': os.environ.get('AUTOCALL_METRICS', '0') == '1', 'profile': False, 'profiling': None}
+_TIMERS = {}
+_COUNTERS = {}
+_PROFILES = {}
+
+
+def enable(profile=False):
+
+    # INPUT:
+    # profile : True to run the outermost instrumented entry points under cProfile
+
+    _STATE['enabled'] = True
+    _STATE['profile'] = profile
+
+
+def disable():
+    _STATE['enabled'] = False
+    _STATE['profile'] = False
+
+
+def enabled():
+    return _STATE['enabled']
+
+
+def reset():
+    _TIMERS.clear()
+    _COUNTERS.clear()
+    _PROFILES.clear()
+
+
+def count(name, value=1):
+
+    # INPUT:
+    # name  : counter name, e.g. 'paths', 'kickouts.2017', 'iv.iterations'
+    # value : increment
+
+    if _STATE['enabled']:
+        _COUNTERS[name] = _COUNTERS.get(name, 0) + value
+
+
+@contextlib.contextmanager
+def _timed(stage):
+    starting_t = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(stage, time.perf_counter() - starting_t)
+
+
+def timer(stage):
+
+    # INPUT:
+    # stage : stage name, e.g. 'rng', 'paths', 'calibration'
+
+    # OUTPUT:
+    # out   : context manager timing its block (does nothing when disabled)
+
+    if not _STATE['enabled']:
+        return contextlib.nullcontext()
+    return _timed(stage)
+
+
+def instrumented(stage):
+
+    # INPUT:
+    # stage : stage name of the decorated entry point
+
+    # OUTPUT:
+    # out   : decorator timing every call (and profiling it when enabled with profile=True,
+    #         unless it runs inside another profiled stage)
+
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not _STATE['enabled']:
+                return f(*args, **kwargs)
+            starting_t = time.perf_counter()
+            try:
+                if _STATE['profile'] and _STATE['profiling'] is None:
+                    # only the outermost stage is profiled (one profiler can be active at a
+                    # time), the nested stages are timed and show up in its profile
+                    import cProfile
+                    profiler = _PROFILES.setdefault(stage, cProfile.Profile())
+                    _STATE['profiling'] = stage
+                    try:
+                        return profiler.runcall(f, *args, **kwargs)
+                    finally:
+                        _STATE['profiling'] = None
+                return f(*args, **kwargs)
+            finally:
+                _record(stage, time.perf_counter() - starting_t)
+        return wrapper
+    return decorator
+
+
+def metrics(top=10):
+
+    # INPUT:
+    # top : number of functions reported by profiled stage
+
+    # OUTPUT:
+    # out : dict of 'timers' (calls, total, max seconds by stage), 'counters' and
+    #       'profiles' (most cumulative-time consuming functions by stage)
+
+    import io
+    import pstats
+
+    profiles = {}
+    for stage, profiler in _PROFILES.items():
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(top)
+        profiles[stage] = stream.getvalue()
+
+    return {'timers': {stage: dict(t) for stage, t in _TIMERS.items()}, 'counters': dict(_COUNTERS), 'profiles': profiles}
+
+
+def emit(path=None, **tags):
+
+    # INPUT:
+    # path : json lines file where the metrics are appended (None = standard output)
+    # tags : extra fields of the record (run id, contract, ...)
+
+    # OUTPUT:
+    # out  : the emitted record
+
+    import sys
+    import json
+
+    record = dict(timestamp=time.time(), **tags)
+    record.update(metrics())
+    line = json.dumps(record, default=float)
+    if path is None:
+        sys.stdout.write(line + '\n')
+    else:
+        with open(path, 'a') as f:
+            f.write(line + '\n')
+
+    return record
+
+
+@contextlib.contextmanager
+def sampling(interval=0.005):
+
+    # INPUT:
+    # interval : sampling period in seconds
+
+    # OUTPUT:
+    # out      : context manager yielding a Counter of 'file:function' -> number of samples
+    #            of the calling thread stack (statistical profile, low overhead)
+
+    import sys
+    import threading
+    import collections
+
+    samples = collections.Counter()
+    target = threading.get_ident()
+    stop = threading.Event()
+
+    def sampler():
+        while not stop.wait(interval):
+            frame = sys._current_frames().get(target)
+            seen = set()
+            while frame is not None:
+                code = frame.f_code
+                key = os.path.basename(code.co_filename) + ':' + code.co_name
+                if key not in seen: # recursive frames counted once
+                    samples[key] += 1
+                    seen.add(key)
+                frame = frame.f_back
+
+    thread = threading.Thread(target=sampler, daemon=True)
+    thread.start()
+    try:
+        yield samples
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _record(stage, elapsed_t):
+    t = _TIMERS.setdefault(stage, {'calls': 0, 'total': 0.0, 'max': 0.0})
+    t['calls'] += 1
+    t['total'] += elapsed_t
+    t['max'] = max(t['max'], elapsed_t)
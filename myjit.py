@@ -0,0 +1,151 @@
+_KERNELS = {}
+
+
+def available():
+
+    # OUTPUT:
+    # out : True if numba can be imported
+
+    try:
+        import numba
+    except ImportError:
+        return False
+    return True
+
+
+def jitPayoff(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, RND):
+
+    # INPUT:
+    # t_steps : time steps
+    # TtM     : time to maturity
+    # Drift   : drift list by time
+    # Vol     : volatility list by time
+    # Disc    : discount rate
+    # S_0     : underlying initial value
+    # S_k     : kickout barrier (scalar or list by time for step-down barriers)
+    # S_p     : protection barrier
+    # N       : nominal value
+    # I       : yearly interest over the nominal
+    # RND     : random terms, matrix of shape (n_simu, len(t_steps))
+
+    # OUTPUT:
+    # out     : array of autocallable structure simulated discounted payoffs
+    #           (compiled per-path loop, falls back to numpy without numba)
+
+    import numpy as np
+    import myautocallable as acl
+
+    kernels = _compile()
+    if kernels is None:
+        return acl.vectorizedPayoff(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, RND)
+
+    TtM, Drift, Vol, Disc = acl.termArrays(t_steps, TtM, Drift, Vol, Disc)
+    S_k = np.broadcast_to(np.asarray(S_k, dtype=float), TtM.shape).copy()
+    RND = np.ascontiguousarray(RND, dtype=float)
+
+    out = np.empty(RND.shape[0])
+    kernels['payoffs'](TtM, Drift, Vol, Disc, float(S_0), S_k, float(S_p), float(I), RND, out)
+    return out
+
+
+def jitMonteCarloPrice(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, n_simu, seed=None, chunk_size=2**14):
+
+    # INPUT:
+    # t_steps    : time steps
+    # TtM        : time to maturity
+    # Drift      : drift list by time
+    # Vol        : volatility list by time
+    # Disc       : discount rate
+    # S_0        : underlying initial value
+    # S_k        : kickout barrier (scalar or list by time for step-down barriers)
+    # S_p        : protection barrier
+    # N          : nominal value
+    # I          : yearly interest over the nominal
+    # n_simu     : number of simulations
+    # seed       : seed of the pseudo-random generator
+    # chunk_size : number of paths drawn from the same random stream
+
+    # OUTPUT:
+    # price      : autocallable structure price
+    # std_err    : standard error of the price
+
+    import numpy as np
+    import myautocallable as acl
+
+    kernels = _compile()
+    if kernels is None:
+        return acl.streamingMonteCarloPrice(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, n_simu, chunk_size, None, seed)[:2]
+
+    TtM, Drift, Vol, Disc = acl.termArrays(t_steps, TtM, Drift, Vol, Disc)
+    S_k = np.broadcast_to(np.asarray(S_k, dtype=float), TtM.shape).copy()
+
+    # random streams are seeded by chunk, not by thread: same result for any number of threads
+    n_simu = int(n_simu)
+    n_chunks = -(-n_simu // int(chunk_size))
+    seed = int(np.random.SeedSequence(seed).generate_state(1)[0] % 2**31)
+
+    sums = np.zeros((n_chunks, 2))
+    kernels['simulate'](TtM, Drift, Vol, Disc, float(S_0), S_k, float(S_p), float(I), seed, n_simu, int(chunk_size), sums)
+
+    total, total_sq = sums.sum(axis=0)
+    price = total / n_simu
+    return float(price), float(np.sqrt(max(total_sq / n_simu - price ** 2, 0.0) / max(n_simu - 1, 1)))
+
+
+def _compile():
+
+    # OUTPUT:
+    # out : dict of compiled kernels (None without numba), compiled (or found missing, with
+    #       a single warning) once by process
+
+    if 'payoffs' in _KERNELS:
+        return _KERNELS
+    if _KERNELS.get('missing'):
+        return None
+    try:
+        from numba import njit, prange
+    except ImportError:
+        import warnings
+        warnings.warn('numba is not installed, falling back to the numpy backend')
+        _KERNELS['missing'] = True
+        return None
+
+    import numpy as np
+
+    @njit(cache=True)
+    def onePath(TtM, Drift, Vol, Disc, S_0, S_k, S_p, I, Z):
+        # underlying dynamics and kick out test date by date
+        S_t = S_0
+        TtM_prev = 0.0
+        for t in range(TtM.shape[0]):
+            dt = TtM[t] - TtM_prev
+            S_t = S_t * np.exp((Drift[t] - 0.5 * Vol[t] ** 2) * dt + Vol[t] * Z[t] * np.sqrt(dt))
+            TtM_prev = TtM[t]
+            if S_t >= S_k[t]:
+                return (1 + TtM[t] * I) * np.exp(- Disc[t] * TtM[t])
+        # kick out barrier never touched before the maturity
+        t = TtM.shape[0] - 1
+        if S_t > S_p:
+            return np.exp(- Disc[t] * TtM[t])
+        return S_t / S_0 * np.exp(- Disc[t] * TtM[t])
+
+    @njit(parallel=True, cache=True)
+    def payoffs(TtM, Drift, Vol, Disc, S_0, S_k, S_p, I, RND, out):
+        for i in prange(RND.shape[0]):
+            out[i] = onePath(TtM, Drift, Vol, Disc, S_0, S_k, S_p, I, RND[i])
+
+    @njit(parallel=True, cache=True)
+    def simulate(TtM, Drift, Vol, Disc, S_0, S_k, S_p, I, seed, n_simu, chunk_size, sums):
+        for c in prange(sums.shape[0]):
+            # seeds the random state of the thread running the chunk
+            np.random.seed(seed + c)
+            Z = np.empty(TtM.shape[0])
+            for i in range(c * chunk_size, min((c + 1) * chunk_size, n_simu)):
+                for t in range(TtM.shape[0]):
+                    Z[t] = np.random.standard_normal()
+                g = onePath(TtM, Drift, Vol, Disc, S_0, S_k, S_p, I, Z)
+                sums[c, 0] += g
+                sums[c, 1] += g * g
+
+    _KERNELS.update(payoffs=payoffs, simulate=simulate)
+    return _KERNELS
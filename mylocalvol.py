@@ -0,0 +1,186 @@
+import collections
+import numpy as np
+import myautocallable as acl
+import myinstrument as ins
+
+
+# dupire local volatility, piecewise constant in time on (TtM[j-1], TtM[j]] and linear in log spot
+LocalVolGrid = collections.namedtuple('LocalVolGrid', ['TtM', 'log_S', 'Vol'])
+
+
+@ins.instrumented('lv.localVolGrid')
+def localVolGrid(ImV, Strk, TtM, Drift, S_0, n_x=256, width=4.0, vol_bounds=(0.01, 2.0), dtype=None):
+
+    # INPUT:
+    # ImV        : implied volatility surface, dataframe by strike (rows) and time (columns)
+    # Strk       : strike prices of the rows (increasing)
+    # TtM        : time to maturity by time (columns of ImV)
+    # Drift      : drift list by time (forwards follow the same dynamics as the pricers)
+    # S_0        : underlying initial value
+    # n_x        : number of log spot nodes
+    # width      : half width of the log spot grid in standard deviations at the last maturity
+    # vol_bounds : local volatility is clipped to [min, max] (arbitrage left in the surface)
+    # dtype      : np.float64 or np.float32, None = float64
+
+    # OUTPUT:
+    # out        : LocalVolGrid of read-only contiguous arrays, built once and reusable
+    #              TtM   : maturities of the surface (n_T)
+    #              log_S : log spot nodes (n_x), increasing
+    #              Vol   : local volatility (n_T, n_x), row j used for times in (TtM[j-1], TtM[j]]
+
+    # The smile of each maturity is fitted as a quadratic total variance w(y) = sigma^2 T in the
+    # log-moneyness y = log(K / F), so its derivatives are smooth; beyond the quoted strikes
+    # w is kept flat. Dupire's formula in total variance (Gatheral) gives the local variance:
+    #   dw/dT / (1 - y/w dw/dy + 1/4 (-1/4 - 1/w + y^2/w^2) (dw/dy)^2 + 1/2 d2w/dy2)
+
+    T = np.asarray(TtM, dtype=float)
+    Drift = np.asarray(Drift, dtype=float)[:len(T)]
+    sigma = np.asarray(ImV, dtype=float)
+    K = np.asarray(Strk, dtype=float)
+
+    # forwards and total variances by maturity
+    log_F = np.log(S_0) + np.cumsum(Drift * np.diff(T, prepend=0))
+    w_atm = np.zeros(len(T))
+
+    # log spot nodes, wide enough for the paths up to the last maturity
+    sd = np.nanmax(sigma) * np.sqrt(T[-1])
+    log_S = np.log(S_0) + np.linspace(-width * sd, width * sd, int(n_x))
+
+    W, dW, d2W, dWdT = np.zeros((4, len(T), len(log_S)))
+    Y = np.zeros((len(T), len(log_S)))
+    fits = []
+    for j in range(len(T)):
+        ok = np.isfinite(sigma[:, j])
+        y = np.log(K[ok]) - log_F[j]
+        a = np.polyfit(y, sigma[ok, j] ** 2 * T[j], min(2, ok.sum() - 1))
+        fits.append((a, y.min(), y.max()))
+        Y[j] = np.clip(log_S - log_F[j], y.min(), y.max())
+        inside = (log_S - log_F[j] >= y.min()) & (log_S - log_F[j] <= y.max())
+        W[j] = np.polyval(a, Y[j])
+        dW[j] = np.polyval(np.polyder(a), Y[j]) * inside
+        d2W[j] = np.polyval(np.polyder(a, 2), Y[j]) * inside if len(a) > 2 else 0.0
+        w_atm[j] = np.polyval(a, 0.0)
+
+        # calendar derivative at fixed moneyness: the previous smile is read at the same
+        # log-moneyness, backward difference from w = 0 at T = 0
+        if j == 0:
+            dWdT[j] = W[j] / T[j]
+        else:
+            a_prev, y_min, y_max = fits[j - 1]
+            dWdT[j] = (W[j] - np.polyval(a_prev, np.clip(log_S - log_F[j], y_min, y_max))) / (T[j] - T[j - 1])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denom = 1 - Y / W * dW + 0.25 * (-0.25 - 1 / W + Y ** 2 / W ** 2) * dW ** 2 + 0.5 * d2W
+        local_var = dWdT / denom
+    local_var = np.where(np.isfinite(local_var) & (denom > 0), local_var, (w_atm / T)[:, None])
+    Vol = np.clip(np.sqrt(np.maximum(local_var, 0.0)), *vol_bounds)
+
+    return LocalVolGrid(*acl.frozen([T, log_S, Vol], dtype))
+
+
+def localVolPayoff(t_steps, TtM, Drift, Disc, S_0, S_k, S_p, N, I, RND, grid):
+
+    # INPUT:
+    # t_steps : time steps
+    # TtM     : time to maturity (or TermStructure, then Drift, Disc are not used)
+    # Drift   : drift list by time
+    # Disc    : discount rate
+    # S_0     : underlying initial value
+    # S_k     : kickout barrier
+    # S_p     : protection barrier
+    # N       : nominal value
+    # I       : yearly interest over the nominal
+    # RND     : random terms, matrix of shape (n_simu, len(t_steps) * n_sub), each time step
+    #           is simulated in n_sub sub-steps, the kick out is observed at the time steps only
+    # grid    : LocalVolGrid (see localVolGrid)
+
+    # OUTPUT:
+    # out     : array of autocallable structure simulated discounted payoffs
+
+    # (volatility taken from the grid, the term structure only gives drift and discount)
+    ts = acl.termStructure(t_steps, TtM, Drift, Drift, Disc, dtype=grid.Vol.dtype)
+    RND = np.asarray(RND, dtype=grid.Vol.dtype)
+    n_steps = len(ts.TtM)
+    n_sub = RND.shape[1] // n_steps
+
+    # sub-step sizes, drifts and local vol rows, prepared once for all the paths
+    dt = np.repeat(ts.dt / n_sub, n_sub)
+    sqrt_dt = np.sqrt(dt)
+    drift_dt = np.repeat(ts.Drift, n_sub) * dt
+    t_start = np.concatenate([[0], np.cumsum(dt)[:-1]])
+    rows = np.minimum(np.searchsorted(grid.TtM, t_start, 'right'), len(grid.TtM) - 1)
+
+    # the log spot nodes are equally spaced: the node below a spot is found by one division
+    # (no search), and the slopes between the nodes are taken once
+    x_0, n_x = grid.log_S[0], len(grid.log_S)
+    inv_h = (n_x - 1) / (grid.log_S[-1] - grid.log_S[0])
+    slope = np.diff(grid.Vol, axis=1)
+
+    x = np.full(RND.shape[0], np.log(S_0), dtype=RND.dtype)
+    t_ko = np.full(RND.shape[0], -1)
+    for k in range(RND.shape[1]):
+        # local vol at the current spot, linear between the two closest nodes
+        pos = np.clip((x - x_0) * inv_h, 0, n_x - 1)
+        i = np.minimum(pos.astype(np.intp), n_x - 2)
+        vol = grid.Vol[rows[k], i] + (pos - i) * slope[rows[k], i]
+
+        # underlying dynamics
+        x += drift_dt[k] - 0.5 * vol ** 2 * dt[k] + vol * sqrt_dt[k] * RND[:, k]
+
+        # kick out barrier touched at the end of a time step
+        if (k + 1) % n_sub == 0:
+            t = k // n_sub
+            t_ko[(t_ko < 0) & (x >= np.log(S_k))] = t
+
+    # discounted payoffs
+    S_T = np.exp(x)
+    out = np.where(S_T > S_p, 1.0, S_T / S_0) * ts.disc[-1]
+    touched = t_ko >= 0
+    out[touched] = (1 + ts.TtM[t_ko[touched]] * I) * ts.disc[t_ko[touched]]
+
+    if ins.enabled():
+        acl.countPaths(t_steps, touched, np.maximum(t_ko, 0))
+
+    return out
+
+
+@ins.instrumented('lv.localVolMonteCarloPrice')
+def localVolMonteCarloPrice(t_steps, TtM, Drift, Disc, S_0, S_k, S_p, N, I, n_simu, grid, n_sub=4, chunk_size=int(1e5), seed=None):
+
+    # INPUT:
+    # t_steps    : time steps
+    # TtM        : time to maturity
+    # Drift      : drift list by time
+    # Disc       : discount rate
+    # S_0        : underlying initial value
+    # S_k        : kickout barrier
+    # S_p        : protection barrier
+    # N          : nominal value
+    # I          : yearly interest over the nominal
+    # n_simu     : number of simulations
+    # grid       : LocalVolGrid (see localVolGrid)
+    # n_sub      : number of sub-steps by time step (each one costs about a time step of the
+    #              flat volatility engine, see the trade-off below)
+    # chunk_size : number of paths generated and priced at once
+    # seed       : seed of the pseudo-random generator
+
+    # OUTPUT:
+    # price      : autocallable structure price
+    # std_err    : standard error of the price
+
+    # The local vol is frozen over a sub-step (euler scheme in log spot), so n_sub trades time
+    # for discretization bias: on the myapp contract n_sub=4 runs in about 3.5x the time of
+    # streamingMonteCarloPrice and its price is within 0.002 (0.3%) of n_sub=32 (about 30x);
+    # n_sub=1 is as fast as the flat engine but biased by about 0.004.
+
+    rng = np.random.default_rng(seed)
+    stats = (0, 0.0, 0.0)
+
+    n_simu = int(n_simu)
+    while stats[0] < n_simu:
+        n_chunk = min(int(chunk_size), n_simu - stats[0])
+        RND = rng.standard_normal((n_chunk, len(t_steps) * int(n_sub)), dtype=grid.Vol.dtype)
+        payoffs = localVolPayoff(t_steps, TtM, Drift, Disc, S_0, S_k, S_p, N, I, RND, grid)
+        stats = acl.mergeStats(stats, acl.chunkStats(payoffs))
+
+    return float(stats[1]), acl.stdErr(stats)
@@ -0,0 +1,100 @@
+import myinstrument as ins
+
+SHEETS = {
+    'Strk': 'Strike_Price',
+    'TtM': 'Maturity',
+    'Call': 'Call_Price',
+    'Put': 'Put_Price',
+    'Spot': 'Underlying_Price',
+    'd_RfR': 'Risk_Free_Rate_EONIA',
+}
+
+
+@ins.instrumented('mkt.loadMarketData')
+def loadMarketData(path, maturity_yrs=None, cache_dir=None):
+
+    # INPUT:
+    # path         : market data excel file
+    # maturity_yrs : column labels of the sheets (None = 2016..2025)
+    # cache_dir    : folder of the binary snapshots (None = '.cache' next to the excel file)
+
+    # OUTPUT:
+    # out          : dict of dataframes 'Strk', 'TtM', 'Call', 'Put', 'Spot', 'd_RfR',
+    #                backed by memory-mapped .npy files (read-only)
+
+    import os
+    import numpy as np
+    import pandas as pd
+
+    if maturity_yrs is None:
+        maturity_yrs = np.arange(2016, 2025+1, 1)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), '.cache')
+
+    # snapshot keyed by the content of the excel file
+    snapshot = os.path.join(cache_dir, os.path.basename(path) + '-' + fileHash(path)[:16])
+    if not os.path.isdir(snapshot):
+        buildSnapshot(path, snapshot, maturity_yrs)
+
+    out = {}
+    for key in SHEETS:
+        values = np.load(os.path.join(snapshot, key + '.npy'), mmap_mode='r')
+        out[key] = pd.DataFrame(values, columns=maturity_yrs, copy=False)
+
+    return out
+
+
+@ins.instrumented('mkt.buildSnapshot')
+def buildSnapshot(path, snapshot, maturity_yrs):
+
+    # INPUT:
+    # path         : market data excel file
+    # snapshot     : folder of the binary snapshot to create
+    # maturity_yrs : column labels of the sheets
+
+    # OUTPUT:
+    # (writes one .npy file by sheet and removes the outdated snapshots of the same file)
+
+    import os
+    import shutil
+    import tempfile
+    import numpy as np
+    import pandas as pd
+
+    cache_dir = os.path.dirname(snapshot)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # write in a temporary folder, then publish it at once
+    tmp = tempfile.mkdtemp(dir=cache_dir)
+    xls_data = pd.ExcelFile(path)
+    for key, sheet in SHEETS.items():
+        data = pd.read_excel(xls_data, sheet_name=sheet, header=None, names=maturity_yrs)
+        np.save(os.path.join(tmp, key + '.npy'), data.to_numpy(dtype=float))
+    try:
+        os.rename(tmp, snapshot)
+    except OSError: # built meanwhile by another process
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    # drop the snapshots of previous versions of the file
+    prefix = os.path.basename(path) + '-'
+    for name in os.listdir(cache_dir):
+        if name.startswith(prefix) and os.path.join(cache_dir, name) != snapshot:
+            shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+
+
+def fileHash(path):
+
+    # INPUT:
+    # path : file path
+
+    # OUTPUT:
+    # out  : sha256 hex digest of the content
+
+    import hashlib
+
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+
+    return h.hexdigest()
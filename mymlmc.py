@@ -0,0 +1,192 @@
+import numpy as np
+import myautocallable as acl
+import myinstrument as ins
+
+
+def monitoringDates(t_steps, TtM, Drift, Vol, Disc, n_obs, level=None):
+
+    # INPUT:
+    # t_steps : time steps
+    # TtM     : time to maturity
+    # Drift   : drift list by time
+    # Vol     : volatility list by time
+    # Disc    : discount rate
+    # n_obs   : number of (equally spaced) observation dates by time step, e.g. 252 for daily
+    # level   : None = all the observation dates, else only one date every 2 ** (L - level)
+    #           in each time step counted back from its end (L = nLevels(n_obs) - 1), so level 0
+    #           observes the time steps only and the dates of a level contain the previous ones
+
+    # OUTPUT:
+    # out     : TermStructure over the observation dates (drift, vol, discount rate of the
+    #           time step they belong to)
+
+    TtM, Drift, Vol, Disc = acl.termArrays(t_steps, TtM, Drift, Vol, Disc)
+    n_obs = int(n_obs)
+
+    j = np.arange(1, n_obs + 1)
+    if level is not None:
+        j = j[(n_obs - j) % 2 ** (nLevels(n_obs) - 1 - level) == 0]
+
+    # dates of each time step (T_prev, T] and the time step they belong to
+    T_prev = np.concatenate([[0], TtM[:-1]])
+    dates = (T_prev[:, None] + j / n_obs * (TtM - T_prev)[:, None]).ravel()
+    step = np.repeat(np.arange(len(TtM)), len(j))
+
+    return acl.termStructure(range(len(dates)), dates, Drift[step], Vol[step], Disc[step])
+
+
+def nLevels(n_obs):
+
+    # OUTPUT:
+    # out : number of levels, from the time steps only (level 0) to all the dates
+
+    return int(np.ceil(np.log2(int(n_obs)))) + 1
+
+
+def levelSamples(ts_f, ts_c, S_0, S_k, S_p, I, Z):
+
+    # INPUT:
+    # ts_f    : TermStructure of the fine dates (see monitoringDates)
+    # ts_c    : TermStructure of the coarse dates (a subset of the fine ones), None on level 0
+    # S_0     : underlying initial value
+    # S_k     : kickout barrier
+    # S_p     : protection barrier
+    # I       : yearly interest over the nominal
+    # Z       : random terms of shape (n_paths, number of fine dates)
+
+    # OUTPUT:
+    # out     : fine payoff minus coarse payoff by path (fine payoff on level 0), both observed
+    #           on the same path, i.e. on the same brownian increments
+
+    S = S_0 * np.exp(np.cumsum(ts_f.drift_dt + ts_f.vol_sqrt_dt * Z, axis=1))
+    P = _observedPayoff(S, ts_f, S_0, S_k, S_p, I)
+    if ts_c is None:
+        return P
+
+    # the path at the coarse dates is the fine path there
+    idx = np.searchsorted(ts_f.TtM, ts_c.TtM)
+    return P - _observedPayoff(S[:, idx], ts_c, S_0, S_k, S_p, I)
+
+
+def _observedPayoff(S, ts, S_0, S_k, S_p, I):
+
+    # INPUT:
+    # S  : underlying at the observation dates of ts, shape (n_paths, number of dates)
+
+    # OUTPUT:
+    # out : discounted payoffs, kick out tested at every observation date
+
+    kicked = S >= S_k
+    touched = kicked.any(axis=1)
+    t_ko = kicked.argmax(axis=1)
+
+    out = np.where(S[:, -1] > S_p, 1.0, S[:, -1] / S_0) * ts.disc[-1]
+    out[touched] = (1 + ts.TtM[t_ko[touched]] * I) * ts.disc[t_ko[touched]]
+    return out
+
+
+@ins.instrumented('mlmc.multilevelMonteCarloPrice')
+def multilevelMonteCarloPrice(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, n_obs, target_rmse, n_pilot=int(1e4), seed=None, max_block=int(1e7)):
+
+    # INPUT:
+    # t_steps     : time steps
+    # TtM         : time to maturity
+    # Drift       : drift list by time
+    # Vol         : volatility list by time
+    # Disc        : discount rate
+    # S_0         : underlying initial value
+    # S_k         : kickout barrier
+    # S_p         : protection barrier
+    # N           : nominal value
+    # I           : yearly interest over the nominal
+    # n_obs       : number of observation dates by time step (kick out tested at each one)
+    # target_rmse : root mean square error of the price to reach
+    # n_pilot     : number of paths by level of the pilot run estimating the level variances
+    # seed        : seed of the pseudo-random generator
+    # max_block   : maximum number of random terms drawn at once (bounds the memory)
+
+    # OUTPUT:
+    # price       : autocallable structure price
+    # std_err     : standard error of the price
+    # levels      : dataframe by level of the number of dates, paths, mean and variance of the
+    #               correction, cost (dates simulated by path) and wall time, with the estimated
+    #               cost of plain monte carlo on all the dates at the same rmse in its attributes
+
+    # The finest level observes all the dates and the paths are exact at any date, so the
+    # estimator has no bias: the whole mse budget goes to the variance, and the paths by level
+    # minimizing the cost are N_l = eps^-2 sqrt(V_l / C_l) sum_k sqrt(V_k C_k) (Giles).
+
+    import time
+    import pandas as pd
+
+    L = nLevels(n_obs)
+    grids = [monitoringDates(t_steps, TtM, Drift, Vol, Disc, n_obs, l) for l in range(L)]
+    rngs = [np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(L)]
+    stats = [(0, 0.0, 0.0)] * L
+    elapsed = [0.0] * L
+
+    def run(l, n_paths):
+        ts_c = grids[l - 1] if l > 0 else None
+        n_dates = len(grids[l].TtM)
+        done = 0
+        starting_t = time.perf_counter()
+        while done < n_paths:
+            n_block = min(n_paths - done, max(1, int(max_block) // n_dates))
+            Y = levelSamples(grids[l], ts_c, S_0, S_k, S_p, I, rngs[l].standard_normal((n_block, n_dates)))
+            stats[l] = acl.mergeStats(stats[l], acl.chunkStats(Y))
+            done += n_block
+        elapsed[l] += time.perf_counter() - starting_t
+        ins.count('mlmc.paths.' + str(l), n_paths)
+
+    # pilot run, then the optimal number of paths by level (topped up if the pilot is short)
+    for l in range(L):
+        run(l, int(n_pilot))
+    V = np.array([s[2] / max(s[0] - 1, 1) for s in stats])
+    C = np.array([len(g.TtM) for g in grids], dtype=float)
+    N_opt = np.ceil(np.sqrt(V / C) * np.sqrt(V * C).sum() / target_rmse ** 2).astype(int)
+    for l in range(L):
+        if N_opt[l] > stats[l][0]:
+            run(l, int(N_opt[l] - stats[l][0]))
+
+    price = sum(s[1] for s in stats)
+    std_err = float(np.sqrt(sum(s[2] / max(s[0] - 1, 1) / s[0] for s in stats)))
+
+    levels = pd.DataFrame({
+        'level': range(L),
+        'n_dates': [len(g.TtM) for g in grids],
+        'n_paths': [s[0] for s in stats],
+        'mean': [s[1] for s in stats],
+        'variance': [s[2] / max(s[0] - 1, 1) for s in stats],
+        'cost': [s[0] * len(g.TtM) for s, g in zip(stats, grids)],
+        'time': elapsed})
+
+    # plain monte carlo on all the dates needs the variance of the fine payoff itself,
+    # estimated on a pilot of the finest level
+    Z = rngs[-1].standard_normal((min(int(n_pilot), max(1, int(max_block) // len(grids[-1].TtM))), len(grids[-1].TtM)))
+    V_fine = levelSamples(grids[-1], None, S_0, S_k, S_p, I, Z).var(ddof=1)
+    levels.attrs['single_level_cost'] = float(np.ceil(V_fine / target_rmse ** 2) * len(grids[-1].TtM))
+
+    return float(price), std_err, levels
+
+
+@ins.instrumented('mlmc.monitoredMonteCarloPrice')
+def monitoredMonteCarloPrice(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, n_obs, n_simu, seed=None, max_block=int(1e7)):
+
+    # INPUT:
+    # (same as multilevelMonteCarloPrice)
+    # n_simu  : number of simulations
+
+    # OUTPUT:
+    # price   : autocallable structure price by plain monte carlo on all the observation dates
+    # std_err : standard error of the price
+
+    ts = monitoringDates(t_steps, TtM, Drift, Vol, Disc, n_obs)
+    rng = np.random.default_rng(seed)
+    stats = (0, 0.0, 0.0)
+
+    n_simu = int(n_simu)
+    while stats[0] < n_simu:
+        n_block = min(n_simu - stats[0], max(1, int(max_block) // len(ts.TtM)))
+        stats = acl.mergeStats(stats, acl.chunkStats(levelSamples(ts, None, S_0, S_k, S_p, I, rng.standard_normal((n_block, len(ts.TtM))))))
+
+    return float(stats[1]), acl.stdErr(stats)
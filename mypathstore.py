@@ -0,0 +1,142 @@
+import collections
+import numpy as np
+import myinstrument as ins
+
+# on-disk store of standard normal terms, one .npy file by chunk of paths and a meta.json,
+# read back as memory-mapped arrays (picklable: only the metadata travels to the workers)
+PathStore = collections.namedtuple('PathStore', ['path', 'entropy', 'n_simu', 't_steps', 'TtM', 'dtype', 'chunk_size'])
+
+# memory maps opened by this process: (path, chunk) -> read-only array
+_OPEN = {}
+
+
+def pathStore(cache_dir, n_simu, t_steps, TtM, seed, dtype=np.float64, chunk_size=2**16):
+
+    # INPUT:
+    # cache_dir  : folder of the stores
+    # n_simu     : number of paths
+    # t_steps    : time steps
+    # TtM        : time to maturity (grid metadata of the store)
+    # seed       : seed of the random terms (needed to find the same store again)
+    # dtype      : np.float64 or np.float32 (halves the size of the store)
+    # chunk_size : number of paths by file
+
+    # OUTPUT:
+    # out        : PathStore, opened if one with the same seed, size and grid exists,
+    #              written otherwise
+
+    import os
+    import hashlib
+    import myautocallable as acl
+
+    if seed is None:
+        raise ValueError('a seed is needed to find the store again')
+
+    TtM = acl.timeGrid(t_steps, TtM)
+    key = repr((seed, int(n_simu), list(t_steps), TtM.tolist(), np.dtype(dtype).name, int(chunk_size)))
+    path = os.path.join(cache_dir, 'paths-' + hashlib.sha256(key.encode()).hexdigest()[:16])
+
+    if not os.path.isfile(os.path.join(path, 'meta.json')):
+        writePathStore(path, n_simu, t_steps, TtM, seed, dtype, chunk_size)
+
+    return openPathStore(path)
+
+
+@ins.instrumented('pst.writePathStore')
+def writePathStore(path, n_simu, t_steps, TtM, seed=None, dtype=np.float64, chunk_size=2**16):
+
+    # INPUT:
+    # path       : folder of the store to create
+    # (other inputs as pathStore)
+
+    # OUTPUT:
+    # (writes one .npy file by chunk and the meta.json, published at once)
+
+    # Every chunk has its own random stream, spawned from the seed: any chunk can be
+    # regenerated or written by a different process without the previous ones.
+
+    import os
+    import json
+    import shutil
+    import tempfile
+    import myautocallable as acl
+
+    TtM = acl.timeGrid(t_steps, TtM)
+    entropy = np.random.SeedSequence(seed).entropy
+    n_simu, chunk_size = int(n_simu), int(chunk_size)
+
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+
+    # write in a temporary folder, then publish it at once
+    tmp = tempfile.mkdtemp(dir=parent)
+    for c in range(-(-n_simu // chunk_size)):
+        rng = np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(c,)))
+        n_chunk = min(chunk_size, n_simu - c * chunk_size)
+        np.save(os.path.join(tmp, _chunkName(c)), rng.standard_normal((n_chunk, len(TtM)), dtype=dtype))
+    meta = dict(entropy=str(entropy), n_simu=n_simu, t_steps=[int(t) for t in t_steps], TtM=TtM.tolist(),
+                dtype=np.dtype(dtype).name, chunk_size=chunk_size)
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    try:
+        os.rename(tmp, path)
+    except OSError: # written meanwhile by another process
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def openPathStore(path):
+
+    # INPUT:
+    # path : folder of the store
+
+    # OUTPUT:
+    # out  : PathStore (the chunks are mapped on first read, by each process)
+
+    import os
+    import json
+
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+
+    return PathStore(os.path.abspath(path), int(meta['entropy']), meta['n_simu'], meta['t_steps'],
+                     np.array(meta['TtM']), np.dtype(meta['dtype']), meta['chunk_size'])
+
+
+def readPaths(store, start, stop):
+
+    # INPUT:
+    # store : PathStore
+    # start : first path
+    # stop  : last path (excluded)
+
+    # OUTPUT:
+    # out   : read-only random terms of shape (stop - start, len(t_steps)), a view on the
+    #         memory map (no copy) when the paths lie in one chunk
+
+    stop = min(int(stop), store.n_simu)
+    first, last = int(start) // store.chunk_size, max(stop - 1, int(start)) // store.chunk_size
+
+    blocks = []
+    for c in range(first, last + 1):
+        offset = c * store.chunk_size
+        blocks.append(_chunk(store, c)[max(int(start) - offset, 0):stop - offset])
+    ins.count('pst.paths', stop - int(start))
+
+    return blocks[0] if len(blocks) == 1 else np.concatenate(blocks)
+
+
+def _chunk(store, c):
+
+    # OUTPUT:
+    # out : memory map of the chunk c, opened once by process
+
+    import os
+
+    key = (store.path, c)
+    if key not in _OPEN:
+        _OPEN[key] = np.load(os.path.join(store.path, _chunkName(c)), mmap_mode='r')
+    return _OPEN[key]
+
+
+def _chunkName(c):
+    return 'chunk-' + str(c).zfill(6) + '.npy'
@@ -0,0 +1,131 @@
+import numpy as np
+import myautocallable as acl
+
+
+def portfolioPrice(contracts, t_steps, TtM, Drift, Vol, Disc, S_0, n_simu, seed=None, chunk_size=int(1e6)):
+
+    # INPUT:
+    # contracts  : dataframe of autocallables on the same underlying, one by row, with columns
+    #              'S_k' kickout barrier, 'S_p' protection barrier, 'I' yearly interest, 'T' maturity
+    #              (a date of t_steps)
+    # t_steps    : time steps up to the longest maturity
+    # TtM        : time to maturity
+    # Drift      : drift list by time
+    # Vol        : volatility list by time
+    # Disc       : discount rate
+    # S_0        : underlying initial value
+    # n_simu     : number of simulations
+    # seed       : seed of the pseudo-random generator
+    # chunk_size : number of paths simulated at once
+
+    # OUTPUT:
+    # out        : copy of contracts with the columns 'price' and 'std_err'
+
+    # All the contracts are priced on the same paths. Per path only the running maximum and
+    # the spot at each date matter, so the paths are sorted once by date and every contract
+    # is a range query on the sorted arrays: the cost grows with paths x dates, the contracts
+    # only add O(sqrt(n_simu)) work each.
+
+    TtM, Drift, Vol, Disc = acl.termArrays(t_steps, TtM, Drift, Vol, Disc)
+    dt = np.diff(TtM, prepend=0)
+
+    B = contracts['S_k'].to_numpy(dtype=float)
+    P = contracts['S_p'].to_numpy(dtype=float)
+    I = contracts['I'].to_numpy(dtype=float)
+    j_T = np.searchsorted(np.asarray(list(t_steps)), contracts['T'].to_numpy()) # maturity index
+    if np.any(j_T >= len(t_steps)) or np.any(np.asarray(list(t_steps))[np.minimum(j_T, len(t_steps) - 1)] != contracts['T'].to_numpy()):
+        raise ValueError('contract maturities must be dates of t_steps')
+
+    # kick out payoff by date and contract, zero after the maturity
+    coef = (1 + TtM[:, None] * I) * np.exp(- Disc * TtM)[:, None]
+    coef[np.arange(len(t_steps))[:, None] > j_T] = 0.0
+    disc_T = np.exp(- Disc[j_T] * TtM[j_T])
+
+    total = np.zeros(len(contracts))
+    total_sq = np.zeros(len(contracts))
+    rng = np.random.default_rng(seed)
+
+    n_simu = int(n_simu)
+    done = 0
+    while done < n_simu:
+        n_chunk = min(int(chunk_size), n_simu - done)
+
+        # underlying paths, simulated once for all the contracts
+        Z = rng.standard_normal((n_chunk, len(t_steps)))
+        S = S_0 * np.exp(np.cumsum((Drift - 0.5 * Vol ** 2) * dt + Vol * np.sqrt(dt) * Z, axis=1))
+        M = np.maximum.accumulate(S, axis=1)
+
+        # number of paths kicked out exactly at each date: running max crosses the barrier
+        M_sorted = np.sort(M, axis=0)
+        kicked = np.stack([n_chunk - np.searchsorted(M_sorted[:, t], B, 'left') for t in range(len(t_steps))])
+        first = np.diff(kicked, axis=0, prepend=0)
+        total += (first * coef).sum(axis=0)
+        total_sq += (first * coef ** 2).sum(axis=0)
+
+        # paths alive at maturity: S_T / S_0 below the protection barrier, 1 above
+        for j in np.unique(j_T):
+            q = np.flatnonzero(j_T == j)
+            alive, n_low, sum_low, sumsq_low = _prefixSums(M[:, j], S[:, j], B[q], P[q])
+            total[q] += disc_T[q] * ((alive - n_low) + sum_low / S_0)
+            total_sq[q] += disc_T[q] ** 2 * ((alive - n_low) + sumsq_low / S_0 ** 2)
+
+        done += n_chunk
+
+    out = contracts.copy()
+    out['price'] = total / n_simu
+    out['std_err'] = np.sqrt(np.maximum(total_sq / n_simu - out['price'].to_numpy() ** 2, 0.0) / max(n_simu - 1, 1))
+    return out
+
+
+def _prefixSums(M, V, B, P):
+
+    # INPUT:
+    # M    : running maximum by path
+    # V    : value by path
+    # B    : barriers by query
+    # P    : thresholds by query
+
+    # OUTPUT:
+    # alive     : by query, number of paths with M < B
+    # n_low     : number of those paths with V <= P
+    # sum_low   : sum of V over them
+    # sumsq_low : sum of V ** 2 over them
+
+    n = len(M)
+    order = np.argsort(M, kind='stable')
+    M_s, V_s = M[order], V[order]
+    alive = np.searchsorted(M_s, B, 'left') # the alive paths are a prefix of M_s
+
+    # V <= P  <=>  rank of V < R
+    v_order = np.argsort(V_s, kind='stable')
+    rank = np.empty(n, dtype=np.int64)
+    rank[v_order] = np.arange(n)
+    R = np.searchsorted(V_s[v_order], P, 'right')
+
+    # prefix = whole blocks of b paths + a remainder shorter than b
+    b = max(1, int(np.sqrt(n)))
+    n_blocks = n // b
+    full = alive // b
+
+    # whole blocks: ranks sorted inside each block, searched all at once with a block offset
+    blk = np.arange(n_blocks)[:, None]
+    rank_b = rank[:n_blocks * b].reshape(n_blocks, b)
+    o = np.argsort(rank_b, axis=1)
+    rank_b = np.take_along_axis(rank_b, o, axis=1)
+    V_b = np.take_along_axis(V_s[:n_blocks * b].reshape(n_blocks, b), o, axis=1)
+    cum = np.concatenate([np.zeros((n_blocks, 1)), np.cumsum(V_b, axis=1)], axis=1)
+    cum_sq = np.concatenate([np.zeros((n_blocks, 1)), np.cumsum(V_b ** 2, axis=1)], axis=1)
+    pos = np.searchsorted((rank_b + blk * n).ravel(), blk * n + R, 'left') - blk * b
+    in_prefix = blk < full
+    n_low = (pos * in_prefix).sum(axis=0)
+    sum_low = (np.take_along_axis(cum, pos, axis=1) * in_prefix).sum(axis=0)
+    sumsq_low = (np.take_along_axis(cum_sq, pos, axis=1) * in_prefix).sum(axis=0)
+
+    # remainder, scanned directly
+    idx = np.minimum(full[:, None] * b + np.arange(b), n - 1)
+    low = (np.arange(b) < (alive - full * b)[:, None]) & (rank[idx] < R[:, None])
+    n_low = n_low + low.sum(axis=1)
+    sum_low = sum_low + (V_s[idx] * low).sum(axis=1)
+    sumsq_low = sumsq_low + (V_s[idx] ** 2 * low).sum(axis=1)
+
+    return alive, n_low, sum_low, sumsq_low
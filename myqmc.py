@@ -0,0 +1,146 @@
+import numpy as np
+import myautocallable as acl
+
+
+def quasiRandom(n_simu, t_steps, TtM, method='sobol', bridge=True, seed=None):
+
+    # INPUT:
+    # n_simu  : number of simulations
+    # t_steps : time steps
+    # TtM     : time to maturity
+    # method  : 'sobol' or 'halton' low-discrepancy sequence (scrambled)
+    # bridge  : True to order the dimensions by brownian bridge construction
+    # seed    : seed of the scrambling
+
+    # OUTPUT:
+    # RND     : standard normal terms of shape (n_simu, len(t_steps)),
+    #           can replace np.random.randn in the autocallable pricers
+
+    import warnings
+    from scipy.stats import qmc
+    from scipy.special import ndtri
+
+    n_steps = len(t_steps)
+    if method == 'sobol':
+        sampler = qmc.Sobol(n_steps, scramble=True, seed=seed)
+    elif method == 'halton':
+        sampler = qmc.Halton(n_steps, scramble=True, seed=seed)
+    else:
+        raise ValueError("method must be 'sobol' or 'halton'")
+
+    with warnings.catch_warnings():
+        # sobol balance properties are only guaranteed for powers of 2
+        warnings.simplefilter('ignore', UserWarning)
+        U = sampler.random(int(n_simu))
+
+    # inverse-normal transform
+    Z = ndtri(np.clip(U, 1e-16, 1 - 1e-16))
+
+    if bridge:
+        Z = brownianBridge(Z, t_steps, TtM)
+
+    return Z
+
+
+def brownianBridge(Z, t_steps, TtM):
+
+    # INPUT:
+    # Z       : standard normal terms of shape (n_simu, len(t_steps)),
+    #           first columns carry the most important dimensions
+    # t_steps : time steps
+    # TtM     : time to maturity
+
+    # OUTPUT:
+    # RND     : standard normal increments by time step, built so that the first column
+    #           fixes the terminal value, the second one the mid point and so on
+
+    TtM = acl.timeGrid(t_steps, TtM)
+    n_steps = len(t_steps)
+
+    # brownian motion at the time steps (index -1 is the origin)
+    W = np.zeros(Z.shape)
+    def at(j):
+        return (0.0, np.zeros(Z.shape[0])) if j < 0 else (TtM[j], W[:, j])
+
+    W[:, -1] = np.sqrt(TtM[-1]) * Z[:, 0]
+    k = 1
+    queue = [(-1, n_steps - 1)]
+    while queue:
+        l, r = queue.pop(0)
+        if r - l < 2:
+            continue
+        m = (l + r) // 2
+        (t_l, W_l), (t_r, W_r) = at(l), at(r)
+        w = (TtM[m] - t_l) / (t_r - t_l)
+        W[:, m] = W_l + w * (W_r - W_l) + np.sqrt(w * (t_r - TtM[m])) * Z[:, k]
+        k += 1
+        queue += [(l, m), (m, r)]
+
+    # normalized increments
+    dt = np.diff(TtM, prepend=0)
+    return np.diff(W, axis=1, prepend=0) / np.sqrt(dt)
+
+
+def quasiMonteCarloPrice(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, n_simu, method='sobol', bridge=True, n_replicates=16, seed=None):
+
+    # INPUT:
+    # t_steps      : time steps
+    # TtM          : time to maturity
+    # Drift        : drift list by time
+    # Vol          : volatility list by time
+    # Disc         : discount rate
+    # S_0          : underlying initial value
+    # S_k          : kickout barrier
+    # S_p          : protection barrier
+    # N            : nominal value
+    # I            : yearly interest over the nominal
+    # n_simu       : total number of simulations (split among the replicates)
+    # method       : 'sobol' or 'halton'
+    # bridge       : True to use the brownian bridge construction
+    # n_replicates : number of independent scramblings (randomized QMC)
+    # seed         : seed of the scramblings
+
+    # OUTPUT:
+    # price        : autocallable structure price
+    # std_err      : standard error estimated over the replicates
+
+    n_rep = int(n_simu) // n_replicates
+    prices = np.zeros(n_replicates)
+    for r, child in enumerate(np.random.SeedSequence(seed).spawn(n_replicates)):
+        RND = quasiRandom(n_rep, t_steps, TtM, method, bridge, np.random.default_rng(child))
+        prices[r] = acl.vectorizedPayoff(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, RND).mean()
+
+    return float(prices.mean()), float(prices.std(ddof=1) / np.sqrt(n_replicates))
+
+
+def compareRMSE(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, r_simu, ref_price, n_runs=20, methods=('mc', 'sobol', 'halton'), seed=None):
+
+    # INPUT:
+    # (contract inputs as quasiMonteCarloPrice)
+    # r_simu    : range of numbers of simulations
+    # ref_price : reference (high precision) price
+    # n_runs    : number of independent runs by point
+    # methods   : 'mc' plain monte carlo, 'sobol' or 'halton' quasi monte carlo
+    # seed      : seed of the runs
+
+    # OUTPUT:
+    # out       : dataframe of rmse and mean wall time by method and number of simulations
+
+    import time
+    import pandas as pd
+
+    rows = []
+    for method in methods:
+        for n_simu in r_simu:
+            errors = np.zeros(n_runs)
+            starting_t = time.time()
+            for k, child in enumerate(np.random.SeedSequence(seed).spawn(n_runs)):
+                if method == 'mc':
+                    RND = np.random.default_rng(child).standard_normal((int(n_simu), len(t_steps)))
+                else:
+                    RND = quasiRandom(n_simu, t_steps, TtM, method, True, np.random.default_rng(child))
+                errors[k] = acl.vectorizedPayoff(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, RND).mean() - ref_price
+            elapsed_t = (time.time() - starting_t) / n_runs
+            rows.append({'method': method, 'n_simu': int(n_simu), 'rmse': np.sqrt((errors ** 2).mean()), 'time': elapsed_t})
+
+    return pd.DataFrame(rows)
@@ -0,0 +1,114 @@
+import collections
+import numpy as np
+import myinstrument as ins
+
+# counter-based generator: the random terms of path i, time step t are a pure function of
+# (key, i, t), so any block of paths is generated directly, on any worker, in any order
+# (block_size is the canonical block of paths the pricers split and merge the paths by)
+CounterRNG = collections.namedtuple('CounterRNG', ['key', 'block_size'])
+
+# philox 4x32-10 constants (Salmon et al., Random123)
+_M0, _M1 = 0xD2511F53, 0xCD9E8D57
+_W0, _W1 = 0x9E3779B9, 0xBB67AE85
+_MASK = 0xFFFFFFFF
+
+
+def counterRNG(seed=None, block_size=2**16):
+
+    # INPUT:
+    # seed       : seed of the generator (None = fresh entropy)
+    # block_size : number of paths of the canonical blocks
+
+    # OUTPUT:
+    # out        : CounterRNG (two 32 bit key words derived from the seed, picklable)
+
+    k0, k1 = np.random.SeedSequence(seed).generate_state(2, dtype=np.uint32)
+    return CounterRNG((int(k0), int(k1)), int(block_size))
+
+
+def philox4x32(c0, c1, c2, c3, key, rounds=10):
+
+    # INPUT:
+    # c0..c3 : the four 32 bit words of the counters (arrays of the same shape)
+    # key    : couple of 32 bit key words
+    # rounds : number of rounds
+
+    # OUTPUT:
+    # out    : the four 32 bit words of the random outputs (uint64 arrays)
+
+    c0, c1, c2, c3 = [np.asarray(c, dtype=np.uint64) for c in (c0, c1, c2, c3)]
+    k0, k1 = key
+    M0, M1, mask = np.uint64(_M0), np.uint64(_M1), np.uint64(_MASK)
+
+    for r in range(rounds):
+        # 32 x 32 bit products fit in 64 bits
+        p0 = M0 * c0
+        p1 = M1 * c2
+        c0, c1, c2, c3 = (p1 >> np.uint64(32)) ^ c1 ^ np.uint64(k0), p1 & mask, (p0 >> np.uint64(32)) ^ c3 ^ np.uint64(k1), p0 & mask
+        k0, k1 = (k0 + _W0) & _MASK, (k1 + _W1) & _MASK
+
+    return c0, c1, c2, c3
+
+
+def readNormals(rng, start, stop, n_steps, stream=0):
+
+    # INPUT:
+    # rng     : CounterRNG
+    # start   : first path index
+    # stop    : last path index (excluded)
+    # n_steps : number of time steps
+    # stream  : index of an independent stream (e.g. 1 for the uniforms of another use)
+
+    # OUTPUT:
+    # out     : standard normal terms of shape (stop - start, n_steps), the same for a path
+    #           whatever the block it is generated in
+
+    # counter (path low, path high, pair of time steps, stream) -> 4 x 32 bits -> two 53 bit
+    # uniforms -> two normals by box-muller, for the time steps 2j and 2j + 1
+
+    x0, x1, x2, x3 = _words(rng, start, stop, n_steps, stream)
+    u1 = _uniform53(x0, x1) + 2.0 ** -53 # (0, 1]
+    u2 = _uniform53(x2, x3) # [0, 1)
+    r = np.sqrt(-2 * np.log(u1))
+
+    out = np.empty((x0.shape[0], 2 * x0.shape[1]))
+    out[:, 0::2] = r * np.cos(2 * np.pi * u2)
+    out[:, 1::2] = r * np.sin(2 * np.pi * u2)
+    ins.count('rng.paths', x0.shape[0])
+
+    return out[:, :int(n_steps)]
+
+
+def readUniforms(rng, start, stop, n_steps, stream=1):
+
+    # INPUT:
+    # (same as readNormals)
+
+    # OUTPUT:
+    # out : uniform terms in [0, 1) of shape (stop - start, n_steps)
+
+    x0, x1, x2, x3 = _words(rng, start, stop, n_steps, stream)
+
+    out = np.empty((x0.shape[0], 2 * x0.shape[1]))
+    out[:, 0::2] = _uniform53(x0, x1)
+    out[:, 1::2] = _uniform53(x2, x3)
+
+    return out[:, :int(n_steps)]
+
+
+def _words(rng, start, stop, n_steps, stream):
+
+    # OUTPUT:
+    # out : philox outputs of shape (stop - start, ceil(n_steps / 2)), one counter by path
+    #       and pair of time steps
+
+    path = np.arange(int(start), int(stop), dtype=np.uint64)[:, None]
+    j = np.arange((int(n_steps) + 1) // 2, dtype=np.uint64)[None, :]
+    path, j = np.broadcast_arrays(path, j)
+
+    return philox4x32(path & np.uint64(_MASK), path >> np.uint64(32), j, np.full(j.shape, stream, dtype=np.uint64), rng.key)
+
+
+def _uniform53(a, b):
+    # 27 + 26 bits of two words -> double in [0, 1)
+    return ((a >> np.uint64(5)) * np.uint64(67108864) + (b >> np.uint64(6))) * 2.0 ** -53
@@ -0,0 +1,375 @@
+import asyncio
+
+# contract fields of the requests (with their defaults, None = required)
+FIELDS = {'S_0': None, 'S_k': None, 'S_p': None, 'I': None, 'T': None, 't_0': 2015, 'N': 1, 'n_simu': int(1e5), 'seed': None}
+MAX_SIMU = int(1e7)
+# maximum number of simulated spot values held at once by a batch (bounds the memory)
+MAX_TERMS = int(1e7)
+
+
+def startService(path=None, host='127.0.0.1', port=8765, window=0.005, max_batch=64, n_workers=None, cache_dir=None):
+
+    # INPUT:
+    # path      : market data excel file (None = res/Data_Pricing.xlsx)
+    # host      : address of the http endpoint
+    # port      : port of the http endpoint
+    # window    : seconds during which concurrent requests are coalesced into one batch
+    # max_batch : maximum number of requests by batch
+    # n_workers : number of threads running the batches (None = number of cpus)
+    # cache_dir : folder of the on-disk calibration cache (None = in-process only)
+
+    # Endpoints (json bodies):
+    # POST /price  : contract fields (see FIELDS) -> price, std_err
+    # POST /greeks : contract fields -> price, delta, gamma, vega, rho and their std_errs
+    # GET /health, GET /metrics (see myinstrument)
+
+    asyncio.run(serve(path, host, port, window, max_batch, n_workers, cache_dir))
+
+
+async def serve(path=None, host='127.0.0.1', port=8765, window=0.005, max_batch=64, n_workers=None, cache_dir=None, ready=None):
+
+    # INPUT:
+    # (same as startService)
+    # ready : None or asyncio.Event set once the endpoint accepts connections
+
+    import os
+    import concurrent.futures
+    import mymarketdata as mkt
+
+    if path is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'res', 'Data_Pricing.xlsx')
+
+    # warm state: market data loaded once, calibrations cached by barrier (see mycalibration),
+    # one pool of threads alive for the whole service (numpy releases the gil)
+    # (the running batches are referenced until done, so they are not garbage collected)
+    state = dict(market=mkt.loadMarketData(path), cache_dir=cache_dir, queue=asyncio.Queue(),
+                 pool=concurrent.futures.ThreadPoolExecutor(n_workers), batches=0, requests=0, running=set())
+
+    batcher = asyncio.ensure_future(_batcher(state, window, max_batch))
+    server = await asyncio.start_server(lambda reader, writer: _handle(state, reader, writer), host, port)
+    print('Pricing service listening on http://' + host + ':' + str(port))
+    if ready is not None:
+        ready.set()
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        batcher.cancel()
+        state['pool'].shutdown(wait=False)
+
+
+def priceBatch(market, contracts, kinds, cache_dir=None):
+
+    # INPUT:
+    # market    : dict of dataframes (see mymarketdata)
+    # contracts : list of contract dicts sharing t_0, T, n_simu and seed
+    # kinds     : list of 'price' or 'greeks' by contract
+    # cache_dir : folder of the on-disk calibration cache
+
+    # OUTPUT:
+    # out       : list of result dicts by contract, all computed on the same random terms,
+    #             simulated in blocks of at most MAX_TERMS spot values
+
+    import numpy as np
+    import myautocallable as acl
+    import mycalibration as cal
+    import mygreeks as grk
+
+    t_steps = range(contracts[0]['t_0'] + 1, contracts[0]['T'] + 1)
+    n_simu = contracts[0]['n_simu']
+
+    # term structure by contract (the drift and vol depend on the protection barrier)
+    inputs = []
+    for c in contracts:
+        InR, ImV, DsR, k_Drift, k_Vol, k_TtM = cal.calibrate(market, c['S_p'], t_steps, 'C', cache_dir)
+        inputs.append(acl.termArrays(t_steps, k_TtM, k_Drift, k_Vol, DsR))
+    TtM, Disc = inputs[0][0], inputs[0][3] # same for all the barriers
+
+    # one seed sequence, every estimator below draws the same stream of random terms from it
+    seed = np.random.SeedSequence(contracts[0]['seed'])
+    out = [None] * len(contracts)
+
+    # prices: one simulation with the contracts on the scenario axis, block by block
+    q = [j for j, kind in enumerate(kinds) if kind == 'price']
+    if q:
+        def column(key, n_dims):
+            return np.array([contracts[j][key] for j in q], dtype=float).reshape((-1,) + (1,) * n_dims)
+        Drift = np.stack([inputs[j][1] for j in q])[:, None, :]
+        Vol = np.stack([inputs[j][2] for j in q])[:, None, :]
+        rng = np.random.default_rng(seed)
+        block_size = max(1, MAX_TERMS // (len(q) * len(t_steps)))
+        stats = [(0, 0.0, 0.0)] * len(q)
+        while stats[0][0] < n_simu:
+            RND = rng.standard_normal((min(block_size, n_simu - stats[0][0]), len(t_steps)))
+            payoffs = acl.vectorizedPayoff(t_steps, TtM, Drift, Vol, Disc, column('S_0', 1), column('S_k', 2), column('S_p', 1), 1, column('I', 1), RND)
+            stats = [acl.mergeStats(stats[k], acl.chunkStats(payoffs[k])) for k in range(len(q))]
+        for k, j in enumerate(q):
+            out[j] = dict(price=float(stats[k][1]), std_err=acl.stdErr(stats[k]))
+
+    # greeks: likelihood ratio estimators on the same random terms
+    for j, kind in enumerate(kinds):
+        if kind == 'greeks':
+            c = contracts[j]
+            greeks, std_errs = grk.likelihoodRatioGreeks(t_steps, TtM, inputs[j][1], inputs[j][2], Disc, c['S_0'], c['S_k'], c['S_p'], c['N'], c['I'], n_simu,
+                                                         seed=seed, block_size=max(1, MAX_TERMS // len(t_steps)))
+            out[j] = dict(greeks, std_errs=std_errs)
+
+    return out
+
+
+async def loadTest(host='127.0.0.1', port=8765, n_requests=1000, concurrency=32, kind='price', n_simu=int(1e4), seed=0):
+
+    # INPUT:
+    # host        : address of the service
+    # port        : port of the service
+    # n_requests  : total number of requests
+    # concurrency : number of clients sending requests at the same time (one connection each)
+    # kind        : 'price' or 'greeks'
+    # n_simu      : number of simulations by request
+    # seed        : seed of the random contracts
+
+    # OUTPUT:
+    # out         : dict of throughput (requests/s), latency percentiles (s), mean batch size, errors
+
+    import time
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    contracts = [dict(S_0=3042, S_k=3042 * rng.uniform(1.05, 1.20), S_p=3042 * rng.uniform(0.80, 0.95), I=rng.uniform(0.02, 0.06), T=2020, n_simu=int(n_simu))
+                 for _ in range(n_requests)]
+    latencies, batches, errors = [], [], [0]
+
+    async def client(todo):
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for c in todo:
+                starting_t = time.perf_counter()
+                status, body = await _request(reader, writer, 'POST', '/' + kind, c)
+                latencies.append(time.perf_counter() - starting_t)
+                if status == 200:
+                    batches.append(body['batch'])
+                else:
+                    errors[0] += 1
+        finally:
+            writer.close()
+
+    starting_t = time.perf_counter()
+    await asyncio.gather(*[client(contracts[i::concurrency]) for i in range(min(concurrency, n_requests))])
+    elapsed_t = time.perf_counter() - starting_t
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return dict(requests=n_requests, concurrency=concurrency, throughput=n_requests / elapsed_t,
+                p50=float(p50), p95=float(p95), p99=float(p99), mean_batch=float(np.mean(batches)) if batches else 0.0, errors=errors[0])
+
+
+async def _batcher(state, window, max_batch):
+
+    # collects the queued requests during window seconds after the first one,
+    # then runs one simulation by group of requests on the same grid
+
+    loop = asyncio.get_running_loop()
+    queue = state['queue']
+
+    while True:
+        batch = [await queue.get()]
+        deadline = loop.time() + window
+        while len(batch) < max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        groups = {}
+        for item in batch:
+            c = item[1]
+            groups.setdefault((c['t_0'], c['T'], c['n_simu'], c['seed']), []).append(item)
+        for group in groups.values():
+            state['batches'] += 1
+            task = asyncio.ensure_future(_runGroup(state, group))
+            state['running'].add(task)
+            task.add_done_callback(state['running'].discard)
+
+
+async def _runGroup(state, group):
+    loop = asyncio.get_running_loop()
+    kinds = [kind for kind, c, future in group]
+    contracts = [c for kind, c, future in group]
+    try:
+        results = await loop.run_in_executor(state['pool'], priceBatch, state['market'], contracts, kinds, state['cache_dir'])
+    except Exception as e:
+        for kind, c, future in group:
+            if not future.done():
+                future.set_exception(e)
+        return
+    for (kind, c, future), result in zip(group, results):
+        if not future.done():
+            future.set_result(dict(result, batch=len(group)))
+
+
+async def _handle(state, reader, writer):
+
+    # one http/1.1 connection, kept alive until the client closes it
+
+    import myinstrument as ins
+
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            request = await _readMessage(reader, request=True)
+            if request is None:
+                break
+            method, target, body = request
+
+            if method == 'GET' and target == '/health':
+                status, out = 200, dict(status='ok', requests=state['requests'], batches=state['batches'])
+            elif method == 'GET' and target == '/metrics':
+                metrics = ins.metrics()
+                status, out = 200, dict(timers=metrics['timers'], counters=metrics['counters'])
+            elif method == 'POST' and target in ('/price', '/greeks'):
+                try:
+                    contract = _contract(body, state['market']['TtM'].columns)
+                except ValueError as e:
+                    status, out = 400, dict(error=str(e))
+                else:
+                    future = loop.create_future()
+                    state['requests'] += 1
+                    await state['queue'].put((target[1:], contract, future))
+                    try:
+                        status, out = 200, await future
+                    except Exception as e:
+                        status, out = 500, dict(error=repr(e))
+            else:
+                status, out = 404, dict(error='unknown endpoint ' + method + ' ' + target)
+
+            _writeMessage(writer, out, status=status)
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+def _contract(body, maturities=None):
+
+    # INPUT:
+    # body       : json request body
+    # maturities : maturity years of the market data (None = not checked)
+
+    # OUTPUT:
+    # out        : contract dict with the defaults of FIELDS, raises ValueError if not valid
+
+    import json
+
+    try:
+        data = json.loads(body or b'{}')
+    except ValueError:
+        raise ValueError('body must be a json object')
+    if not isinstance(data, dict):
+        raise ValueError('body must be a json object')
+
+    unknown = set(data) - set(FIELDS)
+    if unknown:
+        raise ValueError('unknown fields ' + ', '.join(sorted(unknown)))
+
+    out = {}
+    for key, default in FIELDS.items():
+        value = data.get(key, default)
+        if value is None and key != 'seed':
+            raise ValueError('missing field ' + key)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            raise ValueError(key + ' must be a number')
+        out[key] = value
+
+    for key in ('T', 't_0', 'n_simu'):
+        out[key] = int(out[key])
+    if out['T'] <= out['t_0']:
+        raise ValueError('T must be after t_0')
+    if maturities is not None and not set(range(out['t_0'] + 1, out['T'] + 1)) <= set(maturities):
+        raise ValueError('the years after t_0 up to T must be maturities of the market data (' + str(min(maturities)) + ' to ' + str(max(maturities)) + ')')
+    if out['seed'] is not None:
+        if out['seed'] < 0 or out['seed'] != int(out['seed']):
+            raise ValueError('seed must be a non-negative integer')
+        out['seed'] = int(out['seed'])
+    if not 1 < out['n_simu'] <= MAX_SIMU:
+        raise ValueError('n_simu must be between 2 and ' + str(MAX_SIMU))
+    if out['S_0'] <= 0 or out['S_p'] <= 0:
+        raise ValueError('S_0 and S_p must be positive')
+
+    return out
+
+
+async def _readMessage(reader, request=False):
+
+    # OUTPUT:
+    # out : (method, target, body) of a request or (status, body) of a response,
+    #       None when the connection is closed
+
+    line = await reader.readline()
+    if not line:
+        return None
+    first = line.decode('latin-1').split()
+
+    length = 0
+    while True:
+        header = await reader.readline()
+        if header in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = header.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    body = await reader.readexactly(length)
+
+    if request:
+        return first[0], first[1], body
+    return int(first[1]), body
+
+
+def _writeMessage(writer, out, method=None, target=None, status=200):
+
+    # writes a json request (method, target given) or response
+
+    import json
+
+    body = json.dumps(out).encode()
+    if method is not None:
+        head = method + ' ' + target + ' HTTP/1.1\r\nHost: localhost\r\n'
+    else:
+        head = 'HTTP/1.1 ' + str(status) + ' ' + {200: 'OK', 400: 'Bad Request', 404: 'Not Found'}.get(status, 'Internal Server Error') + '\r\n'
+    head += 'Content-Type: application/json\r\nContent-Length: ' + str(len(body)) + '\r\n\r\n'
+    writer.write(head.encode('latin-1') + body)
+
+
+async def _request(reader, writer, method, target, out=None):
+    import json
+
+    _writeMessage(writer, out, method, target)
+    await writer.drain()
+    status, body = await _readMessage(reader)
+    return status, json.loads(body)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='asynchronous pricing service and its load generator')
+    parser.add_argument('what', nargs='?', default='serve', choices=['serve', 'load'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--path', default=None, help='market data excel file')
+    parser.add_argument('--window', type=float, default=0.005, help='batching window (s)')
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--requests', type=int, default=1000, help='load: number of requests')
+    parser.add_argument('--concurrency', type=int, default=32, help='load: concurrent clients')
+    parser.add_argument('--kind', default='price', choices=['price', 'greeks'], help='load: endpoint')
+    parser.add_argument('--n-simu', type=float, default=1e4, help='load: simulations by request')
+    args = parser.parse_args()
+
+    if args.what == 'serve':
+        startService(args.path, args.host, args.port, args.window, args.max_batch, args.workers)
+    else:
+        print(asyncio.run(loadTest(args.host, args.port, args.requests, args.concurrency, args.kind, int(args.n_simu))))
@@ -0,0 +1,241 @@
+import numpy as np
+import myautocallable as acl
+import myblackscholes as bs
+
+
+METHODS = ('antithetic', 'control', 'importance', 'conditional')
+
+# spawn key of the pilot stream of importance sampling, apart from the streams (0,), (1,), ...
+# of the blocks, partitions and estimates spawned from the same seed by the pricers
+_PILOT_KEY = (0xFFFFFFFF,)
+
+
+def reducedMonteCarloPrice(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, n_simu, method='antithetic', seed=None, block_size=int(1e5)):
+
+    # INPUT:
+    # t_steps    : time steps
+    # TtM        : time to maturity
+    # Drift      : drift list by time
+    # Vol        : volatility list by time
+    # Disc       : discount rate
+    # S_0        : underlying initial value
+    # S_k        : kickout barrier
+    # S_p        : protection barrier
+    # N          : nominal value
+    # I          : yearly interest over the nominal
+    # n_simu     : number of simulated paths
+    # method     : 'antithetic'  : pairs of paths on opposite random terms
+    #              'control'     : control variates on the discounted terminal spot and on a
+    #                              put struck at S_p (closed form by myblackscholes.putPrice)
+    #              'importance'  : random terms shifted toward the barriers, reweighted
+    #              'conditional' : last step integrated in closed form
+    # seed       : seed of the pseudo-random generator
+    # block_size : number of samples simulated at once
+
+    # OUTPUT:
+    # price      : autocallable structure price
+    # std_err    : standard error of the price
+    # vrf        : variance reduction factor over plain monte carlo at the same number of paths
+
+    setup = varianceSetup(method, t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, seed)
+    rng = np.random.default_rng(np.random.SeedSequence(seed).spawn(2)[1])
+
+    n_samples = sampleCount(setup, n_simu)
+    moments = 0
+    done = 0
+    while done < n_samples:
+        n_block = min(int(block_size), n_samples - done)
+        moments = moments + blockMoments(setup, rng.standard_normal((n_block, len(t_steps))))
+        done += n_block
+
+    return finalizeMoments(setup, moments)
+
+
+def varianceSetup(method, t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, seed=None, n_pilot=2**14):
+
+    # INPUT:
+    # method  : variance reduction method (see reducedMonteCarloPrice)
+    # (contract inputs as reducedMonteCarloPrice)
+    # seed    : seed of the pilot run (importance sampling)
+    # n_pilot : number of paths of the pilot run
+
+    # OUTPUT:
+    # setup   : dict of numpy arrays and scalars describing the estimator (picklable, so it
+    #           can be shipped to process or spark workers)
+
+    if method not in METHODS:
+        raise ValueError('method must be one of ' + ', '.join(METHODS))
+
+    TtM, Drift, Vol, Disc = acl.termArrays(t_steps, TtM, Drift, Vol, Disc)
+    setup = dict(method=method, t_steps=list(t_steps), TtM=TtM, Drift=Drift, Vol=Vol, Disc=Disc,
+                 S_0=float(S_0), S_k=S_k, S_p=float(S_p), N=N, I=float(I), theta=np.zeros(len(TtM)), control_mean=np.zeros(0))
+
+    if method == 'control':
+        # S_T is lognormal: equivalent flat rate and volatility up to the maturity
+        T = TtM[-1]
+        dt = np.diff(TtM, prepend=0)
+        r_eq = (Drift * dt).sum() / T
+        sigma_eq = np.sqrt((Vol ** 2 * dt).sum() / T)
+        disc_T = np.exp(- Disc[-1] * T)
+        spot_mean = np.exp(r_eq * T) * disc_T
+        put_mean = bs.putPrice(S_0, S_p, T, r_eq, sigma_eq) * np.exp(r_eq * T) * disc_T / S_0
+        setup['control_mean'] = np.array([spot_mean, put_mean])
+
+    elif method == 'importance':
+        # pilot run: constant shift of the random terms minimizing the variance,
+        # negative toward the protection barrier, positive toward the kick out barrier
+        pilot = np.random.SeedSequence(np.random.SeedSequence(seed).entropy, spawn_key=_PILOT_KEY)
+        Z = np.random.default_rng(pilot).standard_normal((n_pilot, len(TtM)))
+        best = np.inf
+        for c in (-1.0, -0.75, -0.5, -0.25, 0.0, 0.25, 0.5):
+            setup['theta'] = c * np.ones(len(TtM))
+            y = _samples(setup, Z)[0]
+            if y.var() < best:
+                best, theta = y.var(), setup['theta']
+        setup['theta'] = theta
+
+    return setup
+
+
+def sampleCount(setup, n_simu):
+
+    # OUTPUT:
+    # out : number of samples for n_simu paths (a sample is a pair of paths when antithetic)
+
+    if setup['method'] == 'antithetic':
+        return max(1, int(n_simu) // 2)
+    return int(n_simu)
+
+
+def pathsBySample(setup):
+
+    # OUTPUT:
+    # out : number of simulated paths by sample (two when antithetic)
+
+    return 2 if setup['method'] == 'antithetic' else 1
+
+
+def blockMoments(setup, Z):
+
+    # INPUT:
+    # setup  : estimator (see varianceSetup)
+    # Z      : standard normal terms of shape (n_samples, len(t_steps))
+
+    # OUTPUT:
+    # out    : array of moment sums, blocks are merged by adding them:
+    #          [count, sum y, sum y^2, sum p, sum p^2, sum x, sum x x', sum x y]
+    #          with y the estimator, p the plain payoff and x the control variates
+
+    y, p, x = _samples(setup, Z)
+    return np.concatenate([[len(y), y.sum(), (y ** 2).sum(), p.sum(), (p ** 2).sum()],
+                           x.sum(axis=0), (x.T @ x).ravel(), x.T @ y])
+
+
+def finalizeMoments(setup, moments):
+
+    # INPUT:
+    # setup   : estimator (see varianceSetup)
+    # moments : summed moments (see blockMoments)
+
+    # OUTPUT:
+    # price   : autocallable structure price
+    # std_err : standard error of the price
+    # vrf     : variance reduction factor over plain monte carlo at the same number of paths
+
+    k = len(setup['control_mean'])
+    n, s_y, s_yy, s_p, s_pp = moments[:5]
+    s_x = moments[5:5 + k]
+    s_xx = moments[5 + k:5 + k + k * k].reshape(k, k)
+    s_xy = moments[5 + k + k * k:]
+
+    price = s_y / n
+    var_y = (s_yy - n * price ** 2) / (n - 1)
+    var_p = (s_pp - s_p ** 2 / n) / (n - 1)
+
+    if k > 0:
+        # optimal coefficients by least squares, on centered moments
+        x_mean = s_x / n
+        c_xx = (s_xx - n * np.outer(x_mean, x_mean)) / (n - 1)
+        c_xy = (s_xy - n * x_mean * price) / (n - 1)
+        beta = np.linalg.solve(c_xx, c_xy)
+        price = price - beta @ (x_mean - setup['control_mean'])
+        var_y = var_y - c_xy @ beta
+
+    # paths used by sample
+    cost = pathsBySample(setup)
+    std_err = np.sqrt(max(var_y, 0.0) / n)
+
+    return float(price), float(std_err), float(var_p / (cost * var_y)) if var_y > 0 else float('inf')
+
+
+def _samples(setup, Z):
+
+    # OUTPUT:
+    # y : estimator by sample
+    # p : plain payoff by sample (reference of the variance reduction factor)
+    # x : control variates by sample (n_samples, k)
+
+    method = setup['method']
+    t_steps, TtM, Drift, Vol, Disc = setup['t_steps'], setup['TtM'], setup['Drift'], setup['Vol'], setup['Disc']
+    S_0, S_k, S_p, N, I = setup['S_0'], setup['S_k'], setup['S_p'], setup['N'], setup['I']
+
+    def payoff(Z):
+        return acl.vectorizedPayoff(t_steps, TtM, Drift, Vol, Disc, S_0, S_k, S_p, N, I, Z)
+
+    p = payoff(Z)
+    x = np.zeros((len(p), 0))
+
+    if method == 'antithetic':
+        y = 0.5 * (p + payoff(-Z))
+
+    elif method == 'control':
+        y = p
+        dt = np.diff(TtM, prepend=0)
+        S_T = S_0 * np.exp(((Drift - 0.5 * Vol ** 2) * dt + Vol * np.sqrt(dt) * Z).sum(axis=1))
+        disc_T = np.exp(- Disc[-1] * TtM[-1])
+        x = np.stack([S_T / S_0 * disc_T, np.maximum(S_p - S_T, 0.0) / S_0 * disc_T], axis=1)
+
+    elif method == 'importance':
+        # random terms drawn around theta, likelihood ratio of the shift
+        theta = setup['theta']
+        Z_shift = Z + theta
+        y = payoff(Z_shift) * np.exp(- Z_shift @ theta + 0.5 * theta @ theta)
+
+    elif method == 'conditional':
+        # path up to the last but one date, then expectation of the last step given S_{T-1}
+        y = _conditionalLastStep(setup, Z)
+
+    return y, p, x
+
+
+def _conditionalLastStep(setup, Z):
+
+    # OUTPUT:
+    # y : payoff by path conditional on the path up to the last but one date
+    #     (the random terms of the last date are not used)
+
+    TtM, Drift, Vol, Disc = setup['TtM'], setup['Drift'], setup['Vol'], setup['Disc']
+    S_0, S_p, I = setup['S_0'], setup['S_p'], setup['I']
+    S_k = np.broadcast_to(np.asarray(setup['S_k'], dtype=float), TtM.shape)
+    dt = np.diff(TtM, prepend=0)
+
+    # paths up to the last but one date
+    log_S = np.log(S_0) + np.cumsum((Drift[:-1] - 0.5 * Vol[:-1] ** 2) * dt[:-1] + Vol[:-1] * np.sqrt(dt[:-1]) * Z[:, :-1], axis=1)
+    log_S = np.concatenate([np.log(S_0) * np.ones((len(Z), 1)), log_S], axis=1)
+    kicked = log_S[:, 1:] >= np.log(S_k[:-1])
+    touched = kicked.any(axis=1)
+    # (no date before the maturity on a single date contract)
+    t_ko = kicked.argmax(axis=1) if kicked.shape[1] > 0 else np.zeros(len(Z), dtype=int)
+
+    # last step: log S_T ~ N(m, s^2) given S_{T-1}
+    m = log_S[:, -1] + (Drift[-1] - 0.5 * Vol[-1] ** 2) * dt[-1]
+    s = Vol[-1] * np.sqrt(dt[-1])
+    p_ko = bs.normCdf((m - np.log(S_k[-1])) / s)
+    p_above = bs.normCdf((m - np.log(S_p)) / s)
+    below = np.exp(m + 0.5 * s ** 2) * bs.normCdf((np.log(S_p) - m - s ** 2) / s) # E[S_T 1{S_T <= S_p}]
+    y = np.exp(- Disc[-1] * TtM[-1]) * ((1 + TtM[-1] * I) * p_ko + (p_above - p_ko) + below / S_0)
+
+    # paths kicked out before the maturity
+    y[touched] = (1 + TtM[t_ko[touched]] * I) * np.exp(- Disc[t_ko[touched]] * TtM[t_ko[touched]])
+
+    return y